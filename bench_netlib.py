@@ -0,0 +1,112 @@
+# copyright (c) 2015 fclaerhout.fr, released under the MIT license.
+
+"""
+Benchmark netlib and track regressions.
+
+Each benchmark reports the best time per call over a few repeats. Results
+can be saved as JSON, in seconds, and compared with a previous run: the exit
+status is 1 if any benchmark slowed down beyond the threshold.
+
+Usage:
+  bench_netlib [options]
+  bench_netlib --help
+
+Options:
+  -k STR, --keyword STR     only run benchmarks whose name contains STR
+  -o FILE, --output FILE    write results as JSON to FILE
+  -b FILE, --baseline FILE  compare results with the JSON results in FILE
+  -t PCT, --threshold PCT   tolerated slowdown, in percent [default: 10]
+  -r INT, --repeat INT      number of repeats per benchmark [default: 3]
+  -h, --help                display full help text
+"""
+
+import random, timeit, array, json, sys
+
+import docopt, netlib # 3rd-party
+
+def _rows(cnt):
+	random.seed(0)
+	return ["%i.%i.%i.%i" % netlib.Ip4(random.randrange(2 ** 32)).split() for _ in xrange(cnt)]
+
+def _iterate(iterable):
+	for _ in iterable: pass
+
+##############
+# benchmarks #
+##############
+
+# each entry is (name, number of calls per repeat, setup), setup returns the callable to time
+
+def _classify(method):
+	ips = tuple(netlib.Ip4(value) for value in xrange(2 ** 22, 2 ** 32, 2 ** 22))
+	return lambda: [method(ip) for ip in ips]
+
+BENCHMARKS = (
+	("ip4/str", 10000, lambda: lambda: netlib.Ip4("192.168.0.1")),
+	("ip4/int", 10000, lambda: lambda: netlib.Ip4(3232235521)),
+	("ip4/bytes", 10000, lambda: lambda: netlib.Ip4(192, 168, 0, 1)),
+	("ip4/add", 10000, lambda: (lambda ip: lambda: ip + 1)(netlib.Ip4("192.168.0.1"))),
+	("ip4/is_class_a", 10, lambda: _classify(netlib.Ip4.is_class_a)),
+	("ip4/is_class_b", 10, lambda: _classify(netlib.Ip4.is_class_b)),
+	("ip4/is_class_c", 10, lambda: _classify(netlib.Ip4.is_class_c)),
+	("ip4/is_class_d", 10, lambda: _classify(netlib.Ip4.is_class_d)),
+	("ip4/is_class_e", 10, lambda: _classify(netlib.Ip4.is_class_e)),
+	("ip4/classify", 10, lambda: _classify(netlib.classify)),
+	("ip4/classify_many", 10, lambda: (lambda values: lambda: netlib.classify_many(values))(array.array(netlib.UINT32, xrange(2 ** 22, 2 ** 32, 2 ** 22)))),
+	("subnet/parse/a", 10000, lambda: lambda: netlib.Subnet("10/8")),
+	("subnet/parse/ab", 10000, lambda: lambda: netlib.Subnet("172.16/12")),
+	("subnet/parse/abc", 10000, lambda: lambda: netlib.Subnet("192.168.1/24")),
+	("subnet/parse/abcd", 10000, lambda: lambda: netlib.Subnet("192.168.1.0/24")),
+	("subnet/split", 10, lambda: lambda: netlib.Subnet("10/8").split(4096)),
+	("subnet/iter", 1, lambda: lambda: _iterate(netlib.Subnet("10/12"))),
+	("subnet/ints", 1, lambda: lambda: _iterate(netlib.Subnet("10/12").ints())),
+	("subnet/contains", 10000, lambda: (lambda n, ip: lambda: ip in n)(netlib.Subnet("10/8"), netlib.Ip4("10.1.2.3"))),
+	("parse/scalar", 1, lambda: (lambda rows: lambda: [netlib.ip4str_to_int32(row) for row in rows])(_rows(100000))),
+	("parse/batch", 1, lambda: (lambda rows: lambda: netlib.parse_many(rows))(_rows(100000))),
+	("format/scalar", 1, lambda: (lambda values: lambda: [str(netlib.Ip4(value)) for value in values])(netlib.parse_many(_rows(100000)))),
+	("format/batch", 1, lambda: (lambda values: lambda: netlib.format_many(values))(netlib.parse_many(_rows(100000)))),
+)
+
+def run(keyword = None, repeat = 3):
+	"return a dict mapping each benchmark name to its best time per call, in seconds"
+	results = {}
+	for name, number, setup in BENCHMARKS:
+		if not keyword or keyword in name:
+			timer = timeit.Timer(setup())
+			results[name] = min(timer.repeat(repeat = repeat, number = number)) / number
+	return results
+
+def compare(results, baseline, threshold):
+	"return the names of the benchmarks slower than baseline by more than $threshold percent"
+	return tuple(
+		name
+		for name in sorted(results)
+		if name in baseline and results[name] > baseline[name] * (1 + threshold / 100.))
+
+def main(args = None):
+	opts = docopt.docopt(
+		doc = __doc__,
+		argv = args)
+	results = run(
+		keyword = opts["--keyword"],
+		repeat = int(opts["--repeat"]))
+	baseline = {}
+	if opts["--baseline"]:
+		with open(opts["--baseline"]) as fp:
+			baseline = json.load(fp)
+	regressions = compare(results, baseline, float(opts["--threshold"]))
+	for name in sorted(results):
+		if name in baseline:
+			print "%-20s %12.3fus %+7.1f%%%s" % (
+				name,
+				results[name] * 1e6,
+				(results[name] / baseline[name] - 1) * 100,
+				" REGRESSION" if name in regressions else "")
+		else:
+			print "%-20s %12.3fus" % (name, results[name] * 1e6)
+	if opts["--output"]:
+		with open(opts["--output"], "w") as fp:
+			json.dump(results, fp, indent = 2, sort_keys = True)
+	return 1 if regressions else 0
+
+if __name__ == "__main__": sys.exit(main())
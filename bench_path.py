@@ -0,0 +1,155 @@
+# copyright (c) 2015 fclaerhout.fr, released under the MIT license.
+
+"""
+Benchmark the read throughput of path trees under concurrent writes.
+
+Reader threads resolve random paths and select the children of their
+parent while a writer thread mounts and unmounts nodes. The lock-free
+readers of path.Node are compared with readers taking the node lock, as
+path.Node did before. If a number of shards is set, the lock-free readers
+are then compared with the same readers querying a path.ShardedRoot.
+
+Usage:
+  bench_path [options]
+  bench_path --help
+
+Options:
+  -t INT, --threads INT      maximum number of reader threads [default: 8]
+  -s SECS, --seconds SECS    duration of each run [default: 2]
+  -d INT, --depth INT        depth of the tree [default: 4]
+  -f INT, --fanout INT       number of children per node [default: 8]
+  -S INT, --shards INT       compare with a sharded root of INT shards [default: 0]
+  -h, --help                 display full help text
+"""
+
+import threading, random, time
+
+import docopt, path # 3rd-party
+
+class _Locked(object):
+	"read path locking the node at each step"
+
+	def _split(self, string):
+		if string.startswith(self.path):
+			string = string.replace(self.path, "", 1)
+		if "/" in string:
+			name, tail = string.split("/", 1)
+		else:
+			name, tail = string, None
+		with self.lock:
+			if not name in self._children:
+				raise path.NoSuchName(name)
+			return self._children[name], tail
+
+	def select(self, *args, **kwargs):
+		with self.lock:
+			return super(_Locked, self).select(*args, **kwargs)
+
+class LockedNode(_Locked, path.Node): pass
+
+class LockedRoot(_Locked, path.Root): pass
+
+def _pairs(depth, fanout):
+	"yield the pairs (parent path, name) of the nodes of the tree, parents first"
+	stack = [("", 0)]
+	while stack:
+		prefix, level = stack.pop()
+		for i in xrange(fanout):
+			name = "n%i" % i
+			yield prefix or "/", name
+			if level + 1 < depth:
+				stack.append((prefix + "/" + name, level + 1))
+
+def _leaves(depth, fanout):
+	return [parent.rstrip("/") + "/" + name for parent, name in _pairs(depth, fanout) if parent.count("/") == depth - 1]
+
+def _build(root_cls, node_cls, depth, fanout):
+	"return the pair (root, paths of the leaves)"
+	root = root_cls("root")
+	for parent, name in _pairs(depth, fanout):
+		root.get(parent).mount(node_cls(name))
+	return root, _leaves(depth, fanout)
+
+def _measure(paths, get, select, mount, umount, threads, seconds):
+	"return the number of read operations per second, while a writer (un)mounts nodes"
+	parents = sorted(set(p.rsplit("/", 1)[0] for p in paths))
+	stop = threading.Event()
+	counts = []
+	def read():
+		cnt = 0
+		rnd = random.Random()
+		while not stop.is_set():
+			leaf = rnd.choice(paths)
+			get(leaf)
+			select(leaf.rsplit("/", 1)[0])
+			cnt += 2
+		counts.append(cnt)
+	def write():
+		while not stop.is_set():
+			parent = random.choice(parents)
+			mount(parent)
+			umount(parent)
+	pool = [threading.Thread(target = read) for _ in xrange(threads)]
+	pool.append(threading.Thread(target = write))
+	for thread in pool:
+		thread.start()
+	time.sleep(seconds)
+	stop.set()
+	for thread in pool:
+		thread.join()
+	return sum(counts) / float(seconds)
+
+def run(root_cls, node_cls, threads, seconds, depth, fanout):
+	"return the number of read operations per second"
+	root, paths = _build(root_cls, node_cls, depth, fanout)
+	node = node_cls("tmp")
+	return _measure(
+		paths,
+		get = root.get,
+		select = lambda parent: root.get(parent).select(),
+		mount = lambda parent: root.get(parent).mount(node),
+		umount = lambda parent: root.get(parent).umount(node.name),
+		threads = threads,
+		seconds = seconds)
+
+def run_sharded(shards, threads, seconds, depth, fanout):
+	"return the number of read operations per second on a non-indexed sharded root"
+	with path.ShardedRoot("root", shards = shards, indexed = False) as root:
+		root.mount_many((parent, path.Node(name)) for parent, name in _pairs(depth, fanout))
+		return _measure(
+			_leaves(depth, fanout),
+			get = root.get,
+			select = root.select,
+			mount = lambda parent: root.mount(parent, path.Node("tmp")),
+			umount = lambda parent: root.umount(parent + "/tmp"),
+			threads = threads,
+			seconds = seconds)
+
+def main(args = None):
+	opts = docopt.docopt(
+		doc = __doc__,
+		argv = args)
+	kwargs = {
+		"seconds": float(opts["--seconds"]),
+		"depth": int(opts["--depth"]),
+		"fanout": int(opts["--fanout"]),
+	}
+	print "%-8s %15s %15s %8s" % ("threads", "locked ops/s", "lock-free ops/s", "ratio")
+	threads = 1
+	while threads <= int(opts["--threads"]):
+		locked = run(LockedRoot, LockedNode, threads = threads, **kwargs)
+		lockfree = run(path.Root, path.Node, threads = threads, **kwargs)
+		print "%-8i %15i %15i %8.2f" % (threads, locked, lockfree, lockfree / locked)
+		threads *= 2
+	shards = int(opts["--shards"])
+	if shards:
+		print
+		print "%-8s %15s %15s %8s" % ("threads", "lock-free ops/s", "sharded ops/s", "ratio")
+		threads = 1
+		while threads <= int(opts["--threads"]):
+			lockfree = run(path.Root, path.Node, threads = threads, **kwargs)
+			sharded = run_sharded(shards, threads = threads, **kwargs)
+			print "%-8i %15i %15i %8.2f" % (threads, lockfree, sharded, sharded / lockfree)
+			threads *= 2
+
+if __name__ == "__main__": main()
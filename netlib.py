@@ -3,7 +3,7 @@
 
 "networking calculation functions and classes"
 
-import math, re
+import itertools, binascii, operator, bisect, socket, struct, random, array, mmap, math, sys, os, re
 
 ####################
 # support routines #
@@ -16,6 +16,190 @@ def ip4_to_int32(a, b, c, d):
 def ip4str_to_int32(string):
 	return ip4_to_int32(*map(int, string.split(".")))
 
+def ip6str_to_int128(string):
+	return int(binascii.hexlify(socket.inet_pton(socket.AF_INET6, string)), 16)
+
+def int128_to_ip6str(value):
+	return socket.inet_ntop(socket.AF_INET6, binascii.unhexlify("%032x" % value))
+
+def _irange(start, stop, step = 1):
+	"xrange() accepting integers beyond the platform word, e.g. 128-bit addresses"
+	try:
+		return xrange(start, stop, step)
+	except OverflowError:
+		return _count(start, stop, step)
+
+def _count(start, stop, step):
+	while (start < stop) if step > 0 else (start > stop):
+		yield start
+		start += step
+
+# array typecode of an unsigned 32-bit integer on this platform:
+UINT32 = "I" if array.array("I").itemsize == 4 else "L"
+
+# netmask of each prefix length, per address width:
+MASKS = tuple((0xFFFFFFFF << (32 - prefix)) & 0xFFFFFFFF for prefix in xrange(33))
+MASKS6 = tuple(((2 ** 128 - 1) << (128 - prefix)) & (2 ** 128 - 1) for prefix in xrange(129))
+_MASKS = {32: MASKS, 128: MASKS6}
+_HOSTMASKS = tuple(0xFFFFFFFF ^ mask for mask in MASKS)
+
+def _int32(obj):
+	"return the 32-bit integer value of an Ip4, a dotted-quad string or an integer"
+	if isinstance(obj, (str, unicode)):
+		return ip4str_to_int32(obj)
+	assert not isinstance(obj, Ip6), "%s: expected an IPv4 address" % obj
+	value = int(obj)
+	assert 0 <= value <= 0xFFFFFFFF, "%s: not a 32-bit address" % obj
+	return value
+
+def _len(obj, size):
+	"return size as the len() of obj, which is bound to the platform word on python 2"
+	if size > sys.maxsize:
+		raise OverflowError("%s: %s addresses, too many for len(), use .size" % (obj, size))
+	return int(size)
+
+def _indices(key, length):
+	"return the triple (start, step, count) of a slice, like slice.indices() but beyond the platform word"
+	step = 1 if key.step is None else int(key.step)
+	assert step, "slice step must not be zero"
+	lower, upper = (0, length) if step > 0 else (-1, length - 1)
+	def clamp(idx, default):
+		if idx is None:
+			return default
+		idx = int(idx)
+		if idx < 0:
+			idx += length
+		return min(max(idx, lower), upper)
+	start = clamp(key.start, lower if step > 0 else upper)
+	stop = clamp(key.stop, upper if step > 0 else lower)
+	if step > 0:
+		return start, step, max(0, (stop - start + step - 1) // step)
+	else:
+		return start, step, max(0, (start - stop - step - 1) // -step)
+
+#####################
+# batch conversions #
+#####################
+
+class InvalidIp4Rows(Exception): pass
+
+def _pack_rows(rows):
+	"""
+	return the pair (string, errors) where string holds the big-endian 32-bit
+	integers of the valid rows and errors the pairs (index, row) of the others
+	"""
+	inet_aton, inet_ntoa, pack = socket.inet_aton, socket.inet_ntoa, struct.Struct("!I").pack
+	packed = []
+	errors = []
+	for idx, row in enumerate(rows):
+		try:
+			data = inet_aton(row)
+			if inet_ntoa(data) == row:
+				packed.append(data)
+				continue
+		except (socket.error, TypeError):
+			pass
+		try:
+			packed.append(pack(ip4str_to_int32(row)))
+		except (AssertionError, ValueError, TypeError, AttributeError):
+			errors.append((idx, row))
+	return "".join(packed), errors
+
+def _unpack(string):
+	"return an array of 32-bit integers from a string of big-endian 32-bit integers"
+	values = array.array(UINT32)
+	values.fromstring(string)
+	if sys.byteorder == "little":
+		values.byteswap()
+	return values
+
+def parse_many(obj):
+	"""
+	parse a column of dotted-quad addresses into an array of 32-bit integers:
+	  * obj is either an iterable of strings or a newline-separated buffer
+	  * canonical rows are packed by inet_aton, others go through ip4str_to_int32
+	  * malformed rows raise InvalidIp4Rows((index, row), ...)
+	"""
+	rows = obj.splitlines() if isinstance(obj, (str, bytearray)) else obj
+	string, errors = _pack_rows(rows)
+	if errors:
+		raise InvalidIp4Rows(*errors)
+	return _unpack(string)
+
+class InvalidSubnetRows(Exception): pass
+
+def _subnet_batch(linenos, lines, addrs, prefixes):
+	"return the pair (netids, prefixes) of arrays from the parallel lists of a batch"
+	string, errors = _pack_rows(addrs)
+	if not errors:
+		netids = _unpack(string)
+		try:
+			prefixes = array.array("B", map(int, prefixes))
+			valid = max(prefixes) <= 32 and not any(itertools.imap(
+				operator.and_,
+				netids,
+				itertools.imap(_HOSTMASKS.__getitem__, prefixes)))
+		except (ValueError, OverflowError):
+			valid = False
+		if not valid: # locate the culprits
+			for idx, prefix in enumerate(prefixes):
+				if not (str(prefix).isdigit() and int(prefix) <= 32 and not netids[idx] & _HOSTMASKS[int(prefix)]):
+					errors.append((idx, None))
+	if errors:
+		raise InvalidSubnetRows(*((linenos[idx], lines[idx]) for idx, _ in errors))
+	return netids, prefixes
+
+def load_subnets(path, batch_size = 65536, chunk_size = 2 ** 22):
+	"""
+	stream a file of slash notations, one per line, memory-mapped, as batches
+	of (netids, prefixes) arrays of at most $batch_size entries:
+	  * short forms are accepted as in Subnet(), e.g. 10/8
+	  * blank lines and lines starting with # are skipped
+	  * malformed lines raise InvalidSubnetRows((lineno, line), ...) for the current batch
+	"""
+	with open(path, "rb") as fp:
+		size = os.fstat(fp.fileno()).st_size
+		if not size:
+			return
+		buf = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
+		try:
+			linenos, lines, addrs, prefixes = [], [], [], []
+			lineno = 0
+			offset = 0
+			while offset < size:
+				end = buf.find("\n", min(offset + chunk_size, size) - 1)
+				end = size if end < 0 else end + 1
+				for line in buf[offset:end].splitlines():
+					lineno += 1
+					line = line.strip()
+					if not line or line[0] == "#":
+						continue
+					addr, _, prefix = line.partition("/")
+					dots = addr.count(".")
+					if dots < 3:
+						addr += ".0" * (3 - dots)
+					linenos.append(lineno)
+					lines.append(line)
+					addrs.append(addr)
+					prefixes.append(prefix)
+					if len(addrs) == batch_size:
+						yield _subnet_batch(linenos, lines, addrs, prefixes)
+						linenos, lines, addrs, prefixes = [], [], [], []
+				offset = end
+			if addrs:
+				yield _subnet_batch(linenos, lines, addrs, prefixes)
+		finally:
+			buf.close()
+
+def format_many(values):
+	"format an iterable of 32-bit integers into a list of dotted-quad strings"
+	values = array.array(UINT32, values if isinstance(values, array.array) else map(int, values))
+	if sys.byteorder == "little":
+		values.byteswap()
+	data = values.tostring()
+	inet_ntoa = socket.inet_ntoa
+	return [inet_ntoa(data[i:i + 4]) for i in xrange(0, len(data), 4)]
+
 ##############
 # data model #
 ##############
@@ -26,9 +210,87 @@ def VlanID(value):
 	assert 1 <= value < 1002 or 1005 < value <= 4094, "%s: invalid vid, see IEEE 802.1Q for details" % value
 	return value
 
+class Ip(object):
+	"width-generic core of Ip4 and Ip6: immutable, hashable and equal to its integer value"
+
+	__slots__ = ("value",)
+
+	bits = None
+
+	def __setattr__(self, key, value):
+		raise AttributeError("%s is immutable" % type(self).__name__)
+
+	__delattr__ = __setattr__
+
+	def __reduce__(self):
+		return (type(self), (self.value,))
+
+	def __hash__(self):
+		return hash(self.value)
+
+	def __repr__(self):
+		return "%s(%s)" % (type(self).__name__, self.value)
+
+	def __int__(self):
+		return self.value
+
+	def __hex__(self):
+		return "0x%X" % self.value
+
+	def __index__(self):
+		return self.value # required for bin()
+
+	def __add__(self, other):
+		value = self.value + int(other)
+		assert 0 <= value < (2 ** self.bits), "%s + %s: out of range" % (self, other)
+		return _ip(type(self), value)
+
+	def __sub__(self, other):
+		value = self.value - int(other)
+		assert 0 <= value < (2 ** self.bits), "%s - %s: out of range" % (self, other)
+		return _ip(type(self), value)
+
+	def __eq__(self, other):
+		if isinstance(other, Ip) and other.bits != self.bits:
+			return False
+		return self.value == int(other)
+
+	def __ne__(self, other):
+		return not (self == other)
+
+	def _int(self, other):
+		"return the integer value of other, which must not be of another address family"
+		if isinstance(other, Ip) and other.bits != self.bits:
+			raise TypeError("%r, %r: cannot order mixed address families" % (self, other))
+		return int(other)
+
+	def __lt__(self, other):
+		return self.value < self._int(other)
+
+	def __le__(self, other):
+		return self.value <= self._int(other)
+
+	def __gt__(self, other):
+		return self.value > self._int(other)
+
+	def __ge__(self, other):
+		return self.value >= self._int(other)
+
+_setvalue = Ip.value.__set__
+
+def _ip(cls, value):
+	"return an Ip4 or Ip6 from an integer, skipping the initializer checks"
+	obj = object.__new__(cls)
+	_setvalue(obj, value)
+	return obj
+
 class InvalidIp4Initializer(Exception): pass
 
-class Ip4(object):
+class Ip4(Ip):
+
+	__slots__ = ()
+
+	bits = 32
 
 	def __init__(self, *args):
 		"""
@@ -40,16 +302,17 @@ class Ip4(object):
 		if len(args) == 1:
 			obj, = args
 			if isinstance(obj, (str, unicode)):
-				self.value = ip4str_to_int32(obj)
-			elif isinstance(obj, int):
-				assert 0 <= obj <= (2 ** 32)
-				self.value = obj
+				value = ip4str_to_int32(obj)
+			elif isinstance(obj, (int, long)):
+				assert 0 <= obj < (2 ** 32)
+				value = obj
 			else:
 				raise InvalidIp4Initializer(args)
 		elif len(args) == 4:
-			self.value = ip4_to_int32(*args)
+			value = ip4_to_int32(*args)
 		else:
 			raise InvalidIp4Initializer(args)
+		_setvalue(self, value)
 
 	def split(self):
 		return (
@@ -59,71 +322,158 @@ class Ip4(object):
 			self.value & 0xFF,
 		)
 
-	def __repr__(self):
-		return "%s(%s)" % (type(self).__name__, self.value)
-
 	def __str__(self):
 		return "%i.%i.%i.%i" % self.split()
 
 	def hex(self):
 		return "%x.%x.%x.%x" % self.split()
 
-	def __int__(self):
-		return self.value
+	# pre-1994 classful networks:
 
-	def __hex__(self):
-		return "0x%X" % self.value
+	def is_class_a(self):
+		return self.value >> 31 == 0b0
 
-	def __index__(self):
-		return self.value # required for bin()
+	def is_class_b(self):
+		return self.value >> 30 == 0b10
 
-	def __add__(self, other):
-		return Ip4(self.value + int(other))
+	def is_class_c(self):
+		return self.value >> 29 == 0b110
 
-	def __sub__(self, other):
-		return Ip4(self.value - int(other))
+	def is_class_d(self):
+		return self.value >> 28 == 0b1110
 
-	def __eq__(self, other):
-		return self.value == int(other)
+	def is_class_e(self):
+		return self.value >> 28 == 0b1111
 
-	def __ne__(self, other):
-		return not (self == other)
+def _ip4(value):
+	"return an Ip4 from a 32-bit integer, skipping the initializer checks"
+	obj = object.__new__(Ip4)
+	_setvalue(obj, value)
+	return obj
 
-	def __lt__(self, other):
-		return self.value < int(other)
+class InvalidIp6Initializer(Exception): pass
 
-	def __le__(self, other):
-		return self.value <= int(other)
+class Ip6(Ip):
 
-	def __gt__(self, other):
-		return self.value > int(other)
+	__slots__ = ()
 
-	def __ge__(self, other):
-		return self.value >= int(other)
+	bits = 128
 
-	# pre-1994 classful networks:
+	def __init__(self, *args):
+		"""
+		instanciate an Ip6 object from either:
+		  * a string, e.g. Ip6("2001:db8::1")
+		  * a 128-bit integer, e.g. Ip6(42)
+		"""
+		if len(args) == 1:
+			obj, = args
+			if isinstance(obj, (str, unicode)):
+				try:
+					value = ip6str_to_int128(obj)
+				except socket.error:
+					raise InvalidIp6Initializer(args)
+			elif isinstance(obj, (int, long)):
+				assert 0 <= obj < (2 ** 128)
+				value = obj
+			else:
+				raise InvalidIp6Initializer(args)
+		else:
+			raise InvalidIp6Initializer(args)
+		_setvalue(self, value)
 
-	def is_class_a(self):
-		return bin(self.value)[3] == "0"
+	def split(self):
+		return tuple((self.value >> shift) & 0xFFFF for shift in xrange(112, -1, -16))
 
-	def is_class_b(self):
-		return bin(self.value)[3:].startswith("10")
+	def __str__(self):
+		return int128_to_ip6str(self.value)
 
-	def is_class_c(self):
-		return bin(self.value)[3:].startswith("110")
+def _to_ip(obj):
+	"return obj as an Ip, strings are parsed as Ip6 if they contain a colon, integers as Ip4"
+	if isinstance(obj, Ip):
+		return obj
+	elif isinstance(obj, (str, unicode)) and ":" in obj:
+		return Ip6(obj)
+	else:
+		return Ip4(obj)
 
-	def is_class_d(self):
-		return bin(self.value)[3:].startswith("1110")
+class IpSequence(object):
 
-	def is_class_e(self):
-		return bin(self.value)[3:].startswith("1111")
+	def __init__(self, start, stop, step = 1, cls = Ip4):
+		"""
+		instanciate a lazy sequence of Ip4 (or Ip6) following the xrange()
+		semantics over integers, e.g. IpSequence(0, 2 ** 32, 256)[42]
+		"""
+		assert step, "step must not be zero"
+		self.start = start
+		self.step = step
+		self.cls = cls
+		if step > 0:
+			self.length = max(0, (stop - start + step - 1) // step)
+		else:
+			self.length = max(0, (start - stop - step - 1) // -step)
+
+	def __repr__(self):
+		return "%s(%s, %s, %s)" % (type(self).__name__, self.start, self.start + self.length * self.step, self.step)
+
+	@property
+	def size(self):
+		"number of addresses, unlike len() not bound to the platform word"
+		return self.length
+
+	def __len__(self):
+		return _len(self, self.length)
+
+	def _imap(self, values):
+		return itertools.imap(_ip4, values) if self.cls is Ip4 else (_ip(self.cls, value) for value in values)
+
+	def ints(self):
+		"return the addresses as a lazy sequence of integers"
+		return _irange(self.start, self.start + self.length * self.step, self.step)
+
+	def __iter__(self):
+		return self._imap(self.ints())
+
+	def __reversed__(self):
+		last = self.start + (self.length - 1) * self.step
+		return self._imap(_irange(last, last - self.length * self.step, -self.step))
+
+	def __getitem__(self, key):
+		if isinstance(key, slice):
+			idx, step, count = _indices(key, self.length)
+			if not count:
+				return IpSequence(self.start, self.start, cls = self.cls)
+			start = self.start + idx * self.step
+			step *= self.step
+			return IpSequence(start, start + count * step, step, cls = self.cls)
+		idx = int(key)
+		if idx < 0:
+			idx += self.length
+		if not 0 <= idx < self.length:
+			raise IndexError(key)
+		return _ip(self.cls, self.start + idx * self.step)
+
+	def __contains__(self, other):
+		other = _to_ip(other)
+		if type(other) is not self.cls:
+			return False
+		offset = int(other) - self.start
+		return not offset % self.step and 0 <= offset // self.step < self.length
+
+	def index(self, item):
+		if not item in self:
+			raise ValueError("%s: not in sequence" % item)
+		return (int(_to_ip(item)) - self.start) // self.step
+
+	def count(self, item):
+		return 1 if item in self else 0
 
 class Range(object):
 
 	def __init__(self, first, last):
-		assert first < last, "%s is not less that %s" % (first, last)
-		self.first = first if isinstance(first, Ip4) else Ip4(first)
-		self.last = last if isinstance(last, Ip4) else Ip4(last)
+		self.first = _to_ip(first)
+		self.last = _to_ip(last)
+		assert type(self.first) is type(self.last), "%s, %s: mixed address families" % (first, last)
+		assert self.first < self.last, "%s is not less that %s" % (first, last)
 
 	def __str__(self):
 		return "%s — %s" % (self.first, self.last)
@@ -131,18 +481,34 @@ class Range(object):
 	def __unicode__(self):
 		return self.__str__().decode("utf-8")
 
-	def __len__(self):
+	@property
+	def size(self):
+		"number of addresses, unlike len() not bound to the platform word"
 		return int(self.last) - int(self.first) + 1
 
+	def __len__(self):
+		return _len(self, self.size)
+
 	def __iter__(self):
-		adr = self.first
-		while adr <= self.last:
-			yield adr
-			adr = adr + 1
+		return iter(self.view())
+
+	def ints(self):
+		"return the addresses as a lazy sequence of integers"
+		return _irange(int(self.first), int(self.last) + 1)
+
+	def view(self):
+		"return the addresses as a lazy IpSequence"
+		return IpSequence(int(self.first), int(self.last) + 1, cls = type(self.first))
+
+	def __getitem__(self, key):
+		return self.view()[key]
+
+	def __reversed__(self):
+		return reversed(self.view())
 
 	def __contains__(self, other):
-		assert isinstance(other, Ip4), "%s: expected Ip4" % type(other).__name__
-		return self.first <= other <= self.last
+		assert isinstance(other, Ip), "%s: expected Ip4 or Ip6" % type(other).__name__
+		return type(other) is type(self.first) and self.first <= other <= self.last
 
 	def __eq__(self, other):
 		return self.first == other.first and self.last == other.last
@@ -154,7 +520,10 @@ class Range(object):
 		return self.last <= other.first
 
 	def index(self, item):
-		return int(item) - int(self.first)
+		return self.view().index(item)
+
+	def count(self, item):
+		return self.view().count(item)
 
 class InvalidSubnetInitializer(Exception): pass
 
@@ -163,8 +532,8 @@ class Subnet(object):
 	def __init__(self, *args):
 		"""
 		instanciate an Subnet object from either:
-		  * a slash notation, e.g. Subnet("10/8")
-		  * a pair (Ip4, prefix)
+		  * a slash notation, e.g. Subnet("10/8") or Subnet("2001:db8::/32")
+		  * a pair (Ip4, prefix) or (Ip6, prefix)
 		"""
 		if len(args) == 1:
 			obj, = args
@@ -177,21 +546,21 @@ class Subnet(object):
 					addr = "%s.0.0" % addr
 				elif re.match("^\d{1,3}\.\d{1,3}\.\d{1,3}$", addr):
 					addr = "%s.0" % addr
-				self.netid = Ip4(addr)
+				self.netid = _to_ip(addr)
 				self.prefix = int(prefix)
 			else:
 				raise InvalidSubnetInitializer(args)
 		elif len(args) == 2:
 			self.netid, self.prefix = args
-			assert isinstance(self.netid, Ip4)
+			assert isinstance(self.netid, Ip)
 			assert isinstance(self.prefix, int)
 		else:
 			raise InvalidSubnetInitializer(args)
 		# post-checks:
-		assert not (int(self.netid) % 2), "%s: netid is not even" % self.netid
-		self.size = 2 ** (32 - self.prefix)
-		self.bcastid = self.netid + (len(self) - 1)
-		assert int(self.bcastid) % 2, "%s: bcastid is not odd" % self.bcastid
+		assert 0 <= self.prefix <= self.netid.bits, "%s: invalid prefix" % self.prefix
+		self.size = 2 ** (self.netid.bits - self.prefix)
+		assert not (int(self.netid) & (self.size - 1)), "%s: netid is not aligned on /%i" % (self.netid, self.prefix)
+		self.bcastid = self.netid + (self.size - 1)
 
 	def __eq__(self, other):
 		return self.netid == other.netid and self.size == other.size
@@ -200,7 +569,7 @@ class Subnet(object):
 		return not (self == other)
 
 	def __len__(self):
-		return self.size
+		return _len(self, self.size)
 
 	def __str__(self):
 		return "%s/%i" % (self.netid, self.prefix)
@@ -216,21 +585,696 @@ class Subnet(object):
 			raise AttributeError(key)
 
 	def __iter__(self):
-		for i in xrange(len(self)):
-			yield self.netid + i
+		return iter(self.view())
+
+	def ints(self):
+		"return the addresses as a lazy sequence of integers"
+		return _irange(int(self.netid), int(self.bcastid) + 1)
 
 	def __contains__(self, other):
-		if isinstance(other, Ip4):
-			return self.netid <= other <= self.bcastid
+		if isinstance(other, Ip):
+			return type(other) is type(self.netid) and self.netid <= other <= self.bcastid
 		elif isinstance(other, Range):
-			return self.netid <= other.first and other.last <= self.bcastid
+			return type(other.first) is type(self.netid) and self.netid <= other.first and other.last <= self.bcastid
 		else:
-			raise AssertionError("%s: expected Ip4 or Range" % type(other).__name__)
+			raise AssertionError("%s: expected Ip4, Ip6 or Range" % type(other).__name__)
+
+	def view(self):
+		"return the addresses as a lazy IpSequence"
+		return IpSequence(int(self.netid), int(self.bcastid) + 1, cls = type(self.netid))
+
+	def __getitem__(self, key):
+		return self.view()[key]
+
+	def __reversed__(self):
+		return reversed(self.view())
+
+	def index(self, item):
+		return self.view().index(item)
+
+	def count(self, item):
+		return self.view().count(item)
+
+	def subnets(self, prefix):
+		"yield, in order, the subnets of the given prefix partitioning this subnet"
+		cls = type(self.netid)
+		assert self.prefix <= prefix <= cls.bits, "%s: invalid prefix for %s" % (prefix, self)
+		for netid in _irange(int(self.netid), int(self.bcastid) + 1, 2 ** (cls.bits - prefix)):
+			yield _subnet(netid, prefix, cls)
 
 	def split(self, cnt):
 		bits = int(math.log(cnt) / math.log(2))
-		prefix = self.prefix + bits
-		return tuple(Subnet(self.netid + (i << (32 - prefix)), prefix) for i in xrange(2 ** bits))
+		return tuple(self.subnets(self.prefix + bits))
+
+class Ip4Set(object):
+
+	def __init__(self, iterable = ()):
+		"""
+		instanciate a sorted set of addresses packed as 32-bit integers from
+		an iterable of Ip4, dotted-quad strings or integers, e.g.
+		Ip4Set(Subnet("10/24")) -- use Ip4Set.from_sorted() on sorted arrays.
+		"""
+		if isinstance(iterable, Ip4Set):
+			self.values = array.array(UINT32, iterable.values)
+		else:
+			self.values = array.array(UINT32, sorted(set(map(_int32, iterable))))
+
+	@classmethod
+	def from_sorted(cls, values):
+		"wrap an array of strictly increasing 32-bit integers, no copy"
+		obj = cls.__new__(cls)
+		obj.values = values
+		return obj
+
+	def __repr__(self):
+		return "%s(%i addresses)" % (type(self).__name__, len(self))
+
+	def __len__(self):
+		return len(self.values)
+
+	def __iter__(self):
+		"yield addresses as integers in ascending order"
+		return iter(self.values)
+
+	def ip4s(self):
+		"yield addresses as Ip4 objects in ascending order"
+		return itertools.imap(_ip4, self.values)
+
+	def __contains__(self, other):
+		value = _int32(other)
+		idx = bisect.bisect_left(self.values, value)
+		return idx < len(self.values) and self.values[idx] == value
+
+	def contains_many(self, iterable):
+		"return a tuple of booleans, one per item of iterable"
+		values = frozenset(self.values) if len(self.values) > 64 else self.values
+		return tuple(_int32(obj) in values for obj in iterable)
+
+	def __eq__(self, other):
+		return self.values == other.values
+
+	def __ne__(self, other):
+		return not (self == other)
+
+	def add(self, other):
+		value = _int32(other)
+		idx = bisect.bisect_left(self.values, value)
+		if idx == len(self.values) or self.values[idx] != value:
+			self.values.insert(idx, value)
+
+	def discard(self, other):
+		value = _int32(other)
+		idx = bisect.bisect_left(self.values, value)
+		if idx < len(self.values) and self.values[idx] == value:
+			del self.values[idx]
+
+	def union(self, other):
+		return self.from_sorted(array.array(UINT32, sorted(set(self.values).union(_values(other)))))
+
+	def intersection(self, other):
+		return self.from_sorted(array.array(UINT32, sorted(set(self.values).intersection(_values(other)))))
+
+	def difference(self, other):
+		return self.from_sorted(array.array(UINT32, sorted(set(self.values).difference(_values(other)))))
+
+	__or__ = union
+
+	__and__ = intersection
+
+	__sub__ = difference
+
+def _values(obj):
+	"return the integers of an Ip4Set or of any iterable of addresses"
+	return obj.values if isinstance(obj, Ip4Set) else map(_int32, obj)
+
+class PrefixTable(object):
+
+	def __init__(self, pairs = ()):
+		"""
+		instanciate a longest-prefix-match table mapping Subnet keys to values,
+		optionally bulk loaded from an iterable of (Subnet, value) pairs.
+		There is one hash table per address family and prefix length, a lookup
+		costs at most one probe per prefix length in use.
+		"""
+		self._tables = {} # (family, prefix) => {netid: value}
+		self._prefixes = {} # family => prefixes in use, longest first
+		self._netids = {} # (family, prefix) => sorted netids, built on demand
+		self.update(pairs)
+
+	def _reindex(self):
+		prefixes = {}
+		for cls, prefix in self._tables:
+			prefixes.setdefault(cls, []).append(prefix)
+		self._prefixes = dict((cls, tuple(sorted(lst, reverse = True))) for cls, lst in prefixes.iteritems())
+		self._netids = {}
+
+	def update(self, pairs):
+		"bulk load an iterable of (Subnet, value) pairs"
+		tables = self._tables
+		for subnet, value in pairs:
+			key = (type(subnet.netid), subnet.prefix)
+			if not key in tables:
+				tables[key] = {}
+			tables[key][int(subnet.netid)] = value
+		self._reindex()
+
+	def __len__(self):
+		return sum(len(table) for table in self._tables.itervalues())
+
+	def __iter__(self):
+		"yield Subnet keys ordered by family, netid, then prefix"
+		for subnet, _ in self.items():
+			yield subnet
+
+	def items(self):
+		quads = sorted(
+			(cls.bits, netid, prefix, value)
+			for (cls, prefix), table in self._tables.iteritems()
+			for netid, value in table.iteritems())
+		for bits, netid, prefix, value in quads:
+			yield _subnet(netid, prefix, Ip4 if bits == 32 else Ip6), value
+
+	def __contains__(self, subnet):
+		table = self._tables.get((type(subnet.netid), subnet.prefix), ())
+		return int(subnet.netid) in table
+
+	def __getitem__(self, subnet):
+		try:
+			return self._tables[(type(subnet.netid), subnet.prefix)][int(subnet.netid)]
+		except KeyError:
+			raise KeyError(str(subnet))
+
+	def __setitem__(self, subnet, value):
+		self.update(((subnet, value),))
+
+	def __delitem__(self, subnet):
+		key = (type(subnet.netid), subnet.prefix)
+		try:
+			table = self._tables[key]
+			del table[int(subnet.netid)]
+		except KeyError:
+			raise KeyError(str(subnet))
+		if not table:
+			del self._tables[key]
+			self._reindex()
+		self._netids.pop(key, None)
+
+	def lookup(self, ip):
+		"return the pair (Subnet, value) of the longest prefix matching ip"
+		ip = _to_ip(ip)
+		cls, value = type(ip), ip.value
+		masks = _MASKS[cls.bits]
+		for prefix in self._prefixes.get(cls, ()):
+			netid = value & masks[prefix]
+			table = self._tables[(cls, prefix)]
+			if netid in table:
+				return _subnet(netid, prefix, cls), table[netid]
+		raise KeyError(str(ip))
+
+	def covering(self, subnet):
+		"return the (Subnet, value) pairs of the prefixes containing subnet, longest first"
+		cls, value = type(subnet.netid), int(subnet.netid)
+		masks = _MASKS[cls.bits]
+		pairs = []
+		for prefix in self._prefixes.get(cls, ()):
+			if prefix <= subnet.prefix:
+				netid = value & masks[prefix]
+				table = self._tables[(cls, prefix)]
+				if netid in table:
+					pairs.append((_subnet(netid, prefix, cls), table[netid]))
+		return tuple(pairs)
+
+	def covered_by(self, subnet):
+		"return the (Subnet, value) pairs of the prefixes contained in subnet, ordered by netid"
+		cls, first, last = type(subnet.netid), int(subnet.netid), int(subnet.bcastid)
+		triples = []
+		for prefix in self._prefixes.get(cls, ()):
+			if prefix >= subnet.prefix:
+				key = (cls, prefix)
+				table = self._tables[key]
+				if not key in self._netids:
+					netids = sorted(table)
+					self._netids[key] = array.array(UINT32, netids) if cls is Ip4 else netids
+				netids = self._netids[key]
+				for idx in xrange(bisect.bisect_left(netids, first), bisect.bisect_right(netids, last)):
+					triples.append((netids[idx], prefix, table[netids[idx]]))
+		triples.sort()
+		return tuple((_subnet(netid, prefix, cls), value) for netid, prefix, value in triples)
+
+def _subnet(netid, prefix, cls = Ip4):
+	"return a Subnet from an aligned netid, skipping the initializer checks"
+	obj = Subnet.__new__(Subnet)
+	obj.prefix = prefix
+	obj.size = 2 ** (cls.bits - prefix)
+	obj.netid = _ip(cls, netid)
+	obj.bcastid = _ip(cls, netid + obj.size - 1)
+	return obj
+
+def _int_to_cidrs(first, last, bits = 32):
+	"yield the pairs (netid, prefix) of the minimal CIDR blocks covering [first, last]"
+	while first <= last:
+		size = (first & -first) or 2 ** bits # largest block aligned on first
+		while size > last - first + 1:
+			size >>= 1
+		yield first, bits + 1 - size.bit_length()
+		first += size
+
+def range_to_cidrs(obj):
+	"return the minimal sorted tuple of Subnet covering a Range"
+	cls = type(obj.first)
+	return tuple(_subnet(netid, prefix, cls) for netid, prefix in _int_to_cidrs(int(obj.first), int(obj.last), cls.bits))
+
+def collapse(iterable):
+	"""
+	merge overlapping or adjacent Ip4, Ip6, Range and Subnet objects into the
+	minimal sorted tuple of Subnet, Ip4 blocks first
+	"""
+	bounds = sorted(
+		(obj.bits, int(obj), int(obj)) if isinstance(obj, Ip) else (obj.first.bits, int(obj.first), int(obj.last))
+		for obj in iterable)
+	subnets = []
+	bits = first = last = None
+	for width, lo, hi in bounds:
+		if width == bits and lo <= last + 1:
+			last = max(last, hi)
+		else:
+			if first is not None:
+				subnets.extend((netid, prefix, bits) for netid, prefix in _int_to_cidrs(first, last, bits))
+			bits, first, last = width, lo, hi
+	if first is not None:
+		subnets.extend((netid, prefix, bits) for netid, prefix in _int_to_cidrs(first, last, bits))
+	return tuple(_subnet(netid, prefix, Ip4 if bits == 32 else Ip6) for netid, prefix, bits in subnets)
+
+class _Interval(object):
+	"treap node keyed on (first, last), augmented with the largest last of its subtree"
+
+	__slots__ = ("first", "last", "obj", "value", "priority", "left", "right", "maxlast")
+
+	def __init__(self, first, last, obj, value):
+		self.first = first
+		self.last = last
+		self.obj = obj
+		self.value = value
+		self.priority = random.random()
+		self.left = self.right = None
+		self.maxlast = last
+
+	def update(self):
+		self.maxlast = max(
+			self.last,
+			self.left.maxlast if self.left else -1,
+			self.right.maxlast if self.right else -1)
+
+class _Block(_Interval):
+	"""
+	treap node of a maximal covered block, blocks of a treap are disjoint and
+	not adjacent, augmented with the smallest first of its subtree and the
+	largest number of free addresses between two consecutive blocks of it
+	"""
+
+	__slots__ = ("minfirst", "maxgap")
+
+	def __init__(self, first, last):
+		super(_Block, self).__init__(first, last, None, None)
+		self.minfirst = first
+		self.maxgap = -1
+
+	def update(self):
+		left, right = self.left, self.right
+		self.minfirst = left.minfirst if left else self.first
+		self.maxlast = right.maxlast if right else self.last
+		self.maxgap = max(
+			left.maxgap if left else -1,
+			self.first - left.maxlast - 1 if left else -1,
+			right.minfirst - self.last - 1 if right else -1,
+			right.maxgap if right else -1)
+
+def _rotate_right(node):
+	pivot = node.left
+	node.left, pivot.right = pivot.right, node
+	node.update()
+	pivot.update()
+	return pivot
+
+def _rotate_left(node):
+	pivot = node.right
+	node.right, pivot.left = pivot.left, node
+	node.update()
+	pivot.update()
+	return pivot
+
+def _treap_insert(node, new):
+	if node is None:
+		return new
+	if (new.first, new.last) < (node.first, node.last):
+		node.left = _treap_insert(node.left, new)
+		if node.left.priority > node.priority:
+			return _rotate_right(node)
+	else:
+		node.right = _treap_insert(node.right, new)
+		if node.right.priority > node.priority:
+			return _rotate_left(node)
+	node.update()
+	return node
+
+def _treap_remove(node, key):
+	if node is None:
+		raise KeyError(key)
+	if key < (node.first, node.last):
+		node.left = _treap_remove(node.left, key)
+	elif key > (node.first, node.last):
+		node.right = _treap_remove(node.right, key)
+	elif not node.left:
+		return node.right
+	elif not node.right:
+		return node.left
+	elif node.left.priority > node.right.priority:
+		node = _rotate_right(node)
+		node.right = _treap_remove(node.right, key)
+	else:
+		node = _rotate_left(node)
+		node.left = _treap_remove(node.left, key)
+	node.update()
+	return node
+
+def _treap_find(node, key):
+	while node and key != (node.first, node.last):
+		node = node.left if key < (node.first, node.last) else node.right
+	return node
+
+def _treap_overlapping(node, lo, hi, nodes):
+	"append to nodes, in order, the nodes overlapping [lo, hi]"
+	while node and node.maxlast >= lo:
+		_treap_overlapping(node.left, lo, hi, nodes)
+		if node.first > hi:
+			break
+		if node.last >= lo:
+			nodes.append(node)
+		node = node.right
+
+def _treap_floor(node, value):
+	"return the node of greatest first less than or equal to value, None if there is none"
+	floor = None
+	while node:
+		if node.first <= value:
+			floor, node = node, node.right
+		else:
+			node = node.left
+	return floor
+
+def _treap_gap(node, after, size, prev):
+	"""
+	return the first address of the first run of $size free addresses
+	between the blocks starting after $after, None if there is none:
+	  * prev is a list holding the last of the block preceding the subtree,
+	    it is updated to the last of the subtree if no run is found in it
+	  * subtrees without such a run are skipped using their maxgap
+	"""
+	if node is None or node.maxlast <= after:
+		return None
+	if node.minfirst > after:
+		if node.minfirst - prev[0] - 1 >= size:
+			return prev[0] + 1
+		if node.maxgap < size:
+			prev[0] = node.maxlast
+			return None
+	first = _treap_gap(node.left, after, size, prev)
+	if first is not None:
+		return first
+	if node.first > after:
+		if node.first - prev[0] - 1 >= size:
+			return prev[0] + 1
+		prev[0] = node.last
+	return _treap_gap(node.right, after, size, prev)
+
+def _treap_walk(node):
+	stack = []
+	while stack or node:
+		if node:
+			stack.append(node)
+			node = node.left
+		else:
+			node = stack.pop()
+			yield node
+			node = node.right
+
+def _bounds(obj):
+	"return the triple (family, first, last) of an Ip4, Ip6, Range or Subnet"
+	if isinstance(obj, Ip):
+		return type(obj), int(obj), int(obj)
+	else:
+		return type(obj.first), int(obj.first), int(obj.last)
+
+class IntervalIndex(object):
+
+	def __init__(self, pairs = ()):
+		"""
+		instanciate an index of Ip4, Ip6, Range or Subnet keys mapped to values,
+		optionally loaded from an iterable of (key, value) pairs. Keys are
+		indexed on their bounds in a treap per address family, so insert,
+		remove, overlap and stab queries cost O(log n) plus the number of hits.
+		The union of the keys is kept as a second treap of disjoint blocks, so
+		next_free() costs O(log n) whatever the number of reservations.
+		"""
+		self._roots = {} # family => treap
+		self._blocks = {} # family => treap of the blocks covered by the keys
+		self._len = 0
+		for obj, value in pairs:
+			self.insert(obj, value)
+
+	def __len__(self):
+		return self._len
+
+	def __iter__(self):
+		"yield the keys, ordered by family then bounds"
+		for obj, _ in self.items():
+			yield obj
+
+	def items(self):
+		for cls in sorted(self._roots, key = lambda cls: cls.bits):
+			for node in _treap_walk(self._roots[cls]):
+				yield node.obj, node.value
+
+	def __contains__(self, obj):
+		cls, first, last = _bounds(obj)
+		return _treap_find(self._roots.get(cls), (first, last)) is not None
+
+	def __getitem__(self, obj):
+		cls, first, last = _bounds(obj)
+		node = _treap_find(self._roots.get(cls), (first, last))
+		if node is None:
+			raise KeyError(str(obj))
+		return node.value
+
+	def insert(self, obj, value = None):
+		"map key obj to value, replacing the value of a key with the same bounds"
+		cls, first, last = _bounds(obj)
+		node = _treap_find(self._roots.get(cls), (first, last))
+		if node:
+			node.obj, node.value = obj, value
+		else:
+			self._roots[cls] = _treap_insert(self._roots.get(cls), _Interval(first, last, obj, value))
+			self._cover(cls, first, last)
+			self._len += 1
+
+	__setitem__ = insert
+
+	def remove(self, obj):
+		cls, first, last = _bounds(obj)
+		try:
+			self._roots[cls] = _treap_remove(self._roots.get(cls), (first, last))
+		except KeyError:
+			raise KeyError(str(obj))
+		self._uncover(cls, first, last)
+		self._len -= 1
+
+	__delitem__ = remove
+
+	def _cover(self, cls, first, last):
+		"merge [first, last] into the blocks, with the blocks it overlaps or is adjacent to"
+		blocks = self._blocks.get(cls)
+		nodes = []
+		_treap_overlapping(blocks, first - 1, last + 1, nodes)
+		for node in nodes:
+			blocks = _treap_remove(blocks, (node.first, node.last))
+			first, last = min(first, node.first), max(last, node.last)
+		self._blocks[cls] = _treap_insert(blocks, _Block(first, last))
+
+	def _uncover(self, cls, first, last):
+		"split the block containing the removed key [first, last] around the addresses no other key covers"
+		nodes = []
+		_treap_overlapping(self._roots.get(cls), first, last, nodes)
+		holes = []
+		lo = first
+		for node in nodes:
+			if node.first > lo:
+				holes.append((lo, node.first - 1))
+			lo = max(lo, node.last + 1)
+			if lo > last:
+				break
+		else:
+			holes.append((lo, last))
+		if not holes:
+			return
+		blocks = self._blocks[cls]
+		block = _treap_floor(blocks, first)
+		blocks = _treap_remove(blocks, (block.first, block.last))
+		lo = block.first
+		for hole_first, hole_last in holes:
+			if hole_first > lo:
+				blocks = _treap_insert(blocks, _Block(lo, hole_first - 1))
+			lo = hole_last + 1
+		if lo <= block.last:
+			blocks = _treap_insert(blocks, _Block(lo, block.last))
+		self._blocks[cls] = blocks
+
+	def overlapping(self, obj):
+		"return the (key, value) pairs overlapping an Ip4, Ip6, Range or Subnet, ordered by bounds"
+		cls, first, last = _bounds(obj)
+		nodes = []
+		_treap_overlapping(self._roots.get(cls), first, last, nodes)
+		return tuple((node.obj, node.value) for node in nodes)
+
+	def stab(self, ip):
+		"return the (key, value) pairs containing ip, ordered by bounds"
+		return self.overlapping(_to_ip(ip))
+
+	def next_free(self, ip, size = 1):
+		"return the first address from ip starting $size free addresses, None if there is none"
+		ip = _to_ip(ip)
+		cls, first = type(ip), int(ip)
+		blocks = self._blocks.get(cls)
+		block = _treap_floor(blocks, first)
+		if block and block.last >= first:
+			first = block.last + 1
+		prev = [first - 1]
+		found = _treap_gap(blocks, first - 1, size, prev)
+		if found is None:
+			found = prev[0] + 1 # after the last block
+		if found + size <= 2 ** cls.bits:
+			return _ip(cls, found)
+		return None
+
+class PoolExhausted(Exception): pass
+
+class AddressInUse(Exception): pass
+
+class AddressPool(object):
+
+	def __init__(self, subnet, reserved = ()):
+		"""
+		instanciate a buddy allocator handing out the addresses of subnet:
+		  * reserved is an iterable of Ip4, Range or Subnet never handed out
+		  * allocate, allocate_subnet and free cost at most one step per prefix length
+		"""
+		assert isinstance(subnet.netid, Ip4), "%s: only Ip4 pools are supported" % subnet
+		self.subnet = subnet
+		self._free = dict((prefix, set()) for prefix in xrange(subnet.prefix, 33)) # prefix => free netids
+		self._free[subnet.prefix].add(int(subnet.netid))
+		self._used = {} # netid => prefix of the blocks in use
+		self.used = 0 # number of addresses in use
+		for block in collapse(reserved):
+			self.reserve(block)
+
+	def __repr__(self):
+		return "%s(%s, %i/%i used)" % (type(self).__name__, self.subnet, self.used, len(self.subnet))
+
+	def utilization(self):
+		"return the ratio of addresses in use"
+		return float(self.used) / len(self.subnet)
+
+	def _take(self, netid, prefix):
+		"mark block netid/prefix as used, splitting the free block containing it"
+		for parent in xrange(prefix, self.subnet.prefix - 1, -1):
+			block = netid & MASKS[parent]
+			if block in self._free[parent]:
+				break
+		else:
+			raise AddressInUse("%s/%i" % (_ip4(netid), prefix))
+		self._free[parent].remove(block)
+		while parent < prefix:
+			parent += 1
+			half = 2 ** (32 - parent)
+			if netid & half:
+				self._free[parent].add(block)
+				block += half
+			else:
+				self._free[parent].add(block + half)
+		self._used[netid] = prefix
+		self.used += 2 ** (32 - prefix)
+
+	def _allocate(self, prefix):
+		"return the netid of a free block of the given prefix"
+		assert self.subnet.prefix <= prefix <= 32, "%s: invalid prefix for %s" % (prefix, self.subnet)
+		for parent in xrange(prefix, self.subnet.prefix - 1, -1):
+			if self._free[parent]:
+				block = self._free[parent].pop()
+				break
+		else:
+			raise PoolExhausted("%s: no free /%i" % (self.subnet, prefix))
+		while parent < prefix:
+			parent += 1
+			self._free[parent].add(block + 2 ** (32 - parent))
+		self._used[block] = prefix
+		self.used += 2 ** (32 - prefix)
+		return block
+
+	def reserve(self, obj):
+		"mark an Ip4, Range or Subnet as used"
+		if isinstance(obj, Ip4):
+			self._take(int(obj), 32)
+		else:
+			for netid, prefix in _int_to_cidrs(int(obj.first), int(obj.last)):
+				self._take(netid, prefix)
+
+	def allocate(self):
+		"return a free Ip4"
+		return _ip4(self._allocate(32))
+
+	def allocate_subnet(self, prefix):
+		"return a free Subnet of the given prefix"
+		return _subnet(self._allocate(prefix), prefix)
+
+	def free(self, obj):
+		"release an Ip4 or a Subnet previously allocated or reserved"
+		netid = int(obj) if isinstance(obj, Ip4) else int(obj.netid)
+		prefix = 32 if isinstance(obj, Ip4) else obj.prefix
+		assert self._used.get(netid) == prefix, "%s: not in use" % obj
+		del self._used[netid]
+		self.used -= 2 ** (32 - prefix)
+		while prefix > self.subnet.prefix:
+			buddy = netid ^ 2 ** (32 - prefix)
+			if not buddy in self._free[prefix]:
+				break
+			self._free[prefix].remove(buddy)
+			netid &= ~(2 ** (32 - prefix))
+			prefix -= 1
+		self._free[prefix].add(netid)
+
+	def dumps(self):
+		"return the blocks in use as a compact binary string"
+		netids = array.array(UINT32, sorted(self._used))
+		prefixes = array.array("B", (self._used[netid] for netid in netids))
+		if sys.byteorder == "little":
+			netids.byteswap()
+		header = struct.pack("!IBI", int(self.subnet.netid), self.subnet.prefix, len(netids))
+		return header + netids.tostring() + prefixes.tostring()
+
+	@classmethod
+	def loads(cls, data):
+		"return a pool from the output of dumps()"
+		netid, prefix, cnt = struct.unpack_from("!IBI", data)
+		offset = struct.calcsize("!IBI")
+		netids = array.array(UINT32)
+		netids.fromstring(data[offset:offset + 4 * cnt])
+		if sys.byteorder == "little":
+			netids.byteswap()
+		prefixes = array.array("B")
+		prefixes.fromstring(data[offset + 4 * cnt:offset + 5 * cnt])
+		pool = cls(_subnet(netid, prefix))
+		for netid, prefix in itertools.izip(netids, prefixes):
+			pool._take(netid, prefix)
+		return pool
 
 PRIVATE = (
 	Subnet("10/8"),
@@ -238,3 +1282,58 @@ PRIVATE = (
 	Subnet("192.168/16"))
 
 LOOPBACK = (Subnet("127/8"),)
+
+LINK_LOCAL = (Subnet("169.254/16"),)
+
+MULTICAST = (Subnet("224/4"),)
+
+RESERVED = (
+	Subnet("0/8"),
+	Subnet("240/4"))
+
+##################
+# classification #
+##################
+
+# flags returned by classify():
+CLASS_A = 0x001
+CLASS_B = 0x002
+CLASS_C = 0x004
+CLASS_D = 0x008
+CLASS_E = 0x010
+IS_PRIVATE = 0x020
+IS_LOOPBACK = 0x040
+IS_MULTICAST = 0x080
+IS_LINK_LOCAL = 0x100
+IS_RESERVED = 0x200
+
+def _classification_table():
+	"return the flags of each /16, all the classified blocks are /16 or larger"
+	table = array.array("H", [0]) * 2 ** 16
+	for subnets, flag in (
+		((Subnet("0/1"),), CLASS_A),
+		((Subnet("128/2"),), CLASS_B),
+		((Subnet("192/3"),), CLASS_C),
+		((Subnet("224/4"),), CLASS_D),
+		((Subnet("240/4"),), CLASS_E),
+		(PRIVATE, IS_PRIVATE),
+		(LOOPBACK, IS_LOOPBACK),
+		(MULTICAST, IS_MULTICAST),
+		(LINK_LOCAL, IS_LINK_LOCAL),
+		(RESERVED, IS_RESERVED)):
+		for subnet in subnets:
+			for idx in xrange(int(subnet.netid) >> 16, (int(subnet.bcastid) >> 16) + 1):
+				table[idx] |= flag
+	return table
+
+_CLASSIFICATION = _classification_table()
+
+def classify(ip):
+	"return the classification flags of an Ip4, a dotted-quad string or a 32-bit integer"
+	value = ip.value if isinstance(ip, Ip4) else _int32(ip)
+	return _CLASSIFICATION[value >> 16]
+
+def classify_many(values):
+	"return the classification flags of an iterable of 32-bit integers, as an array"
+	table = _CLASSIFICATION
+	return array.array("H", [table[value >> 16] for value in values])
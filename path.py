@@ -6,7 +6,22 @@ Simple filesystem-like container.
 Notes:
   * You can use the default root (see example) or define a new `path.Root()`.
   * a node can only be mounted once, use link() otherwise
-  * node.path is resolved only if the node is mounted
+  * node.path is resolved only if the node is mounted, then cached until unmounted
+  * readers (get, select, exists, path) never lock: they only use atomic dict
+    operations, writers (mount, umount, link) serialize on the parent node lock,
+    then on the flat index lock of an indexed root, see Root(), or on a lock of
+    the tree they write to otherwise
+  * select() can be answered from secondary indexes on a node's children, see
+    Node.add_index(), they are maintained on mount and umount
+  * watch() delivers mount, link and umount events in batches, one per operation
+    or per batched() block, see Watch
+  * a tree can be dumped to a binary snapshot and loaded back in one pass, or
+    lazily: a node's children are then decoded on first access, see Root.load()
+  * set_root() switches the module-level functions to another Root
+  * a ShardedRoot spreads the top-level subtrees across processes, it has its
+    own API, a subset of the module-level functions, see its limits
+  * walk() and glob() are lazy: a node's children are only listed when reached,
+    links are followed on demand and never twice along the same branch
 
 Example:
 	>>> import path
@@ -18,10 +33,12 @@ Example:
 	True
 	>>> path.get("/foo")
 	<Node foo>
+	>>> [p for p, _ in path.glob("/f*")]
+	["/foo"]
 	>>> path.umount("/foo")
 """
 
-import threading, weakref
+import multiprocessing, threading, contextlib, itertools, traceback, weakref, fnmatch, bisect, struct, Queue, mmap, zlib, sys, re
 
 class NoSuchName(Exception): pass
 
@@ -30,41 +47,552 @@ class NameExists(Exception): pass
 def _deref(node):
 	return node.node_ref() if isinstance(node, Link) else node
 
+def _root_of(node):
+	"return the Root node is mounted under, None if it is not mounted under one"
+	while node._parentref:
+		node = node._parentref()
+		if node is None:
+			return None
+	return node if isinstance(node, Root) else None
+
+def _path_of(node, root):
+	"return the path of node resolved from its parents, without cache nor lock, None if it is not mounted under root"
+	names = []
+	while node._parentref:
+		names.append(node.name)
+		node = node._parentref()
+		if node is None:
+			return None
+	return "/" + "/".join(reversed(names)) if node is root else None
+
+def _top_of(node):
+	"return the topmost node above node, node itself if it is not mounted"
+	while node._parentref:
+		parent = node._parentref()
+		if parent is None:
+			break
+		node = parent
+	return node
+
+# the writers of a tree without flat index serialize on the lock of its top node,
+# as do the (un)mounts of its subtree into or from an indexed root, which (un)index
+# it; the locks are striped by node identity, unrelated trees rarely share one:
+_subtree_locks = tuple(threading.Lock() for _ in xrange(64))
+
+def _subtree_lock(node):
+	return _subtree_locks[(id(node) >> 4) % len(_subtree_locks)]
+
+@contextlib.contextmanager
+def _indexing(node, subtrees = ()):
+	"""
+	yield the Root node is mounted under while holding its flat index lock, or
+	None while holding the lock of the top node above node if there is no flat index:
+	  * the locks of the $subtrees, the nodes mounted or unmounted under node, are
+	    held too: they are (un)indexed on either side of the change and must not
+	    be changed while they are
+	"""
+	while True:
+		top = _top_of(node)
+		stripes = set(_subtree_lock(subtree) for subtree in subtrees)
+		if isinstance(top, Root) and top._index is not None:
+			root, locks = top, [top._index_lock]
+		else:
+			root, locks = None, []
+			stripes.add(_subtree_lock(top))
+		locks.extend(sorted(stripes, key = _subtree_locks.index)) # in a global order
+		with contextlib.nested(*locks):
+			if _top_of(node) is top:
+				yield root
+				return
+		# moved under another top meanwhile, retry
+
+def _walk_subtree(node, path):
+	"yield the pairs (path, node) of node and its descendants, links are not followed"
+	stack = [(path, node)]
+	while stack:
+		path, node = stack.pop()
+		yield path, node
+		if node._children:
+			prefix = path.rstrip("/") + "/"
+			stack.extend((prefix + name, child) for name, child in node._children.items())
+
+def _invalidate(node):
+	"forget the cached path of node and its descendants"
+	stack = [node]
+	while stack:
+		node = stack.pop()
+		with node.lock:
+			node._path = None
+		stack.extend(node._children.values())
+
+def _on_chain(node, chain):
+	"return True if node is in the chain (node, (parent, (...)))"
+	while chain:
+		if chain[0] is node:
+			return True
+		chain = chain[1]
+	return False
+
+def _walk(node, path, depth, follow_links):
+	"yield the pairs (path, node) of node and its descendants up to $depth levels below"
+	stack = [(path, node, 0, None)]
+	while stack:
+		path, node, level, chain = stack.pop()
+		target = _deref(node)
+		yield path, target
+		if depth is not None and level >= depth:
+			continue
+		if target is not node:
+			if not follow_links or target is None or _on_chain(target, chain):
+				continue
+			node = target
+		children = node._children.items() # atomic snapshot
+		if children:
+			if follow_links:
+				chain = (node, chain)
+			prefix = path.rstrip("/") + "/"
+			level += 1
+			stack.extend((prefix + name, child, level, chain) for name, child in children)
+
+def _compile(pattern):
+	"return the segments of a glob pattern: names, match functions for wildcards, None for '**'"
+	segments = []
+	for name in pattern.strip("/").split("/") if pattern.strip("/") else ():
+		if name == "**":
+			if segments and segments[-1] is None:
+				continue
+			segments.append(None)
+		elif any(char in name for char in "*?["):
+			segments.append(re.compile(fnmatch.translate(name)).match)
+		else:
+			segments.append(name)
+	return tuple(segments)
+
+def _glob(node, path, segments, follow_links):
+	"""
+	yield the pairs (path, node) of node and its descendants matching the segments:
+	  * the pattern is run as an NFA, a node carries the set of segments it may match next
+	  * subtrees with no such segment are pruned, literal names are looked up, not scanned
+	"""
+	cnt = len(segments)
+	closures = {}
+	transitions = {}
+	def closure(states):
+		"add the states reached by '**' matching zero names"
+		key = frozenset(states)
+		if not key in closures:
+			result = set(key)
+			for i in sorted(key):
+				while i < cnt and segments[i] is None:
+					i += 1
+					result.add(i)
+			closures[key] = frozenset(result)
+		return closures[key]
+	def transition(states):
+		"return the tuple (accepts, default, literals, wildcards) of a set of states"
+		if not states in transitions:
+			stars = set()
+			literals = {}
+			wildcards = []
+			for i in states:
+				if i == cnt:
+					continue
+				segment = segments[i]
+				if segment is None:
+					stars.add(i)
+				elif isinstance(segment, basestring):
+					literals.setdefault(segment, set()).add(i + 1)
+				else:
+					wildcards.append((segment, i + 1))
+			transitions[states] = (
+				cnt in states,
+				closure(stars), # states of a child matching no literal nor wildcard
+				dict((name, closure(stars | nexts)) for name, nexts in literals.items()),
+				tuple(wildcards))
+		return transitions[states]
+	stack = [(path, node, closure((0,)), None)]
+	while stack:
+		path, node, states, chain = stack.pop()
+		target = _deref(node)
+		accepts, default, literals, wildcards = transition(states)
+		if accepts:
+			yield path, target
+		if target is not node:
+			if not follow_links or target is None or _on_chain(target, chain):
+				continue
+			node = target
+		if not default and not wildcards and not literals:
+			continue
+		if follow_links:
+			chain = (node, chain)
+		prefix = path.rstrip("/") + "/"
+		if not default and not wildcards:
+			for name, nexts in literals.items():
+				child = node._children.get(name)
+				if child is not None:
+					stack.append((prefix + name, child, nexts, chain))
+		elif not wildcards and not literals:
+			stack.extend((prefix + name, child, default, chain) for name, child in node._children.items())
+		else:
+			for name, child in node._children.items():
+				nexts = literals.get(name, default)
+				if wildcards:
+					matched = [i for match, i in wildcards if match(name)]
+					if matched:
+						nexts = closure(nexts.union(matched))
+				if nexts:
+					stack.append((prefix + name, child, nexts, chain))
+
+# node.path cache statistics, see cache_info():
+_cache_stats = {"hits": 0, "misses": 0}
+
+def cache_info():
+	"return the pair (hits, misses) of the node.path cache"
+	return _cache_stats["hits"], _cache_stats["misses"]
+
 def Path(obj):
 	assert isinstance(obj, (str, unicode)), "%s: invalid path" % repr(obj)
 	return obj
 
+class Watch(object):
+	"""
+	mount, link and umount events of a node's children, or descendants if recursive:
+	  * an event is a tuple (kind, path, node), path is relative to the watched node
+	    and node is the mounted or unmounted node, the target for links
+	  * events are delivered in batches, lists of events, to the callback and/or the
+	    queue, in the writer thread, once its locks are released
+	  * a callback error does not fail the writer, whose change is applied: it is
+	    printed on stderr and counted in self.errors
+	  * if neither is set, the watch has its own queue and iterating over it blocks
+	    for the next batch until it is closed
+	"""
+
+	def __init__(self, node, recursive = False, callback = None, queue = None):
+		self.node = node
+		self.recursive = recursive
+		self.callback = callback
+		self._owns_queue = not queue and not callback
+		self.queue = Queue.Queue() if self._owns_queue else queue
+		self.errors = 0 # number of callback errors
+
+	def _deliver(self, events):
+		if self.callback:
+			try:
+				self.callback(events)
+			except Exception:
+				self.errors += 1
+				sys.stderr.write("%s: watch callback failed, events dropped:\n" % self.node.name)
+				traceback.print_exc()
+		if self.queue is not None:
+			self.queue.put(events)
+
+	def close(self):
+		with self.node.lock:
+			if self in self.node._watches:
+				self.node._watches = tuple(watch for watch in self.node._watches if watch is not self)
+				with _watch_lock:
+					_watch_stats["watches"] -= 1
+		if self._owns_queue:
+			self.queue.put(None) # stop iterating
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def __iter__(self):
+		assert self.queue is not None, "cannot iterate over a callback watch"
+		while True:
+			events = self.queue.get()
+			if events is None:
+				return
+			yield events
+
+# number of open watches, events are not even resolved if there are none:
+_watch_stats = {"watches": 0}
+
+# serializes the updates of _watch_stats, watches are added under different node locks:
+_watch_lock = threading.Lock()
+
+# events of the thread's batched() block, None outside of one:
+_pending = threading.local()
+
+def _coalesce(events):
+	"drop the pairs of events mounting then unmounting a node at the same path"
+	mounted = {}
+	dropped = set()
+	for i, (kind, path, node) in enumerate(events):
+		if kind != "umount":
+			mounted[path] = i
+		elif path in mounted and events[mounted[path]][2] is node:
+			dropped.update((mounted.pop(path), i))
+	return [event for i, event in enumerate(events) if not i in dropped]
+
+def _notify(changes):
+	"""
+	resolve the (kind, parent, child) changes into the events of the watches and
+	deliver them, or defer them to the end of the enclosing batched() block
+	"""
+	if not _watch_stats["watches"]:
+		return
+	events = getattr(_pending, "events", None)
+	if events is None:
+		events = []
+	for kind, parent, child in changes:
+		node = parent
+		names = [child.name]
+		recursive = False
+		while node:
+			for watch in node._watches:
+				if not recursive or watch.recursive:
+					events.append((watch, (kind, "/".join(reversed(names)), _deref(child))))
+			names.append(node.name)
+			recursive = True
+			node = node._parentref() if node._parentref else None
+	if getattr(_pending, "events", None) is None:
+		_deliver(events)
+
+def _deliver(events):
+	"deliver the (watch, event) pairs, a coalesced batch per watch"
+	batches = {}
+	watches = []
+	for watch, event in events:
+		if not id(watch) in batches:
+			batches[id(watch)] = []
+			watches.append(watch)
+		batches[id(watch)].append(event)
+	for watch in watches:
+		batch = _coalesce(batches[id(watch)])
+		if batch:
+			watch._deliver(batch)
+
+@contextlib.contextmanager
+def batched():
+	"defer the events of the operations of this thread to the end of the block, as one batch per watch"
+	if getattr(_pending, "events", None) is not None:
+		yield # nested, the outer block delivers
+		return
+	_pending.events = []
+	try:
+		yield
+	finally:
+		events, _pending.events = _pending.events, None
+		_deliver(events)
+
+class _Greatest(object):
+	"compare greater than anything else, used to bisect past all the entries of a key"
+
+	def __lt__(self, other): return False
+
+	def __gt__(self, other): return True
+
+_GREATEST = _Greatest()
+
+class _SortedIndex(object):
+	"names of the children sorted by key, answering range and top-k queries"
+
+	def __init__(self, key):
+		self.key = key
+		self.clear()
+
+	def clear(self):
+		self.entries = [] # sorted (key, name) pairs
+		self.keys = {} # name => key, as indexed
+
+	def add(self, name, node):
+		self.insert(name, self.key(node))
+
+	def insert(self, name, value):
+		"add name under the key value, as computed by key()"
+		self.keys[name] = value
+		bisect.insort(self.entries, (value, name))
+
+	def add_many(self, pairs):
+		"add the (name, node) pairs, sorting once"
+		for name, node in pairs:
+			self.keys[name] = self.key(node)
+		self.entries = sorted((value, name) for name, value in self.keys.items())
+
+	def remove(self, name):
+		value = self.keys.pop(name)
+		del self.entries[bisect.bisect_left(self.entries, (value, name))]
+
+	chunk = 64 # number of entries copied at once by names()
+
+	def names(self, lo = None, hi = None, reverse = False):
+		"""
+		yield the names whose key is in [lo, hi], in key order:
+		  * the entries are copied by chunks, each chunk is located again after the
+		    last entry yielded, concurrent mounts and umounts never shift the iteration
+		"""
+		if reverse:
+			bound = None if hi is None else (hi, _GREATEST)
+			while True:
+				entries = self.entries
+				j = len(entries) if bound is None else bisect.bisect_left(entries, bound)
+				chunk = entries[max(0, j - self.chunk):j]
+				for value, name in reversed(chunk):
+					if lo is not None and value < lo:
+						return
+					yield name
+				if len(chunk) < self.chunk:
+					return
+				bound = chunk[0]
+		else:
+			bound = None if lo is None else (lo,)
+			while True:
+				entries = self.entries
+				i = 0 if bound is None else bisect.bisect_right(entries, bound)
+				chunk = entries[i:i + self.chunk]
+				for value, name in chunk:
+					if hi is not None and value > hi:
+						return
+					yield name
+				if len(chunk) < self.chunk:
+					return
+				bound = chunk[-1]
+
+class _BucketIndex(object):
+	"names of the children bucketed by key, answering equality queries"
+
+	def __init__(self, key):
+		self.key = key
+		self.clear()
+
+	def clear(self):
+		self.buckets = {} # key => set of names
+		self.keys = {} # name => key, as indexed
+
+	def add(self, name, node):
+		self.insert(name, self.key(node))
+
+	def insert(self, name, value):
+		"add name under the key value, as computed by key()"
+		self.keys[name] = value
+		self.buckets.setdefault(value, set()).add(name)
+
+	def add_many(self, pairs):
+		for name, node in pairs:
+			self.add(name, node)
+
+	def remove(self, name):
+		value = self.keys.pop(name)
+		bucket = self.buckets[value]
+		bucket.discard(name)
+		if not bucket:
+			del self.buckets[value]
+
+	def names(self, lo = None, hi = None, reverse = False):
+		"yield the names whose key is lo, in no particular order"
+		assert lo is not None and lo == hi, "bucket index: equality queries only, set lo == hi"
+		return iter(tuple(self.buckets.get(lo, ())))
+
 class Node(object):
 
 	def __init__(self, name):
 		self._parentref = None
 		self._children = {}
+		self._path = None
+		self._indexes = {}
+		self._watches = ()
 		self.name = name
 		self.lock = threading.Lock()
 
+	def __getattr__(self, name):
+		"decode the children of a node lazily loaded from a snapshot on first access"
+		if name != "_children" or not "_snapshot" in self.__dict__:
+			raise AttributeError(name)
+		with _snapshot_lock:
+			if not "_children" in self.__dict__:
+				snapshot, offsets = self.__dict__.pop("_snapshot")
+				self._children = snapshot.children(self, offsets)
+		return self._children
+
 	@property
 	def path(self):
+		path = self._path
+		if path is not None:
+			_cache_stats["hits"] += 1
+			return path
+		_cache_stats["misses"] += 1
 		with self.lock:
 			assert self._parentref, "%s: unmounted node has no resolvable path" % self.name
-			return self._parentref().path.rstrip("/") + "/" + self.name
+			self._path = self._parentref().path.rstrip("/") + "/" + self.name
+			return self._path
 
 	@property
 	def root(self):
+		node = self
+		parentref = node._parentref
+		while parentref:
+			node = parentref()
+			parentref = node._parentref
+		assert isinstance(node, Root), "%s: not a root" % node.name
+		return node
+
+	def _attach(self, nodes):
+		"""
+		add nodes to the children, their indexes and the flat index of the root:
+		  * the node lock, then the index lock, are taken once for all the nodes
+		  * the nodes are checked and their index keys computed first, none is
+		    added if one cannot be or if a key function raises
+		"""
 		with self.lock:
-			if self._parentref:
-				return self._parentref().root
-			else:
-				assert isinstance(self, Root), "%s: not a root" % self.name
-				return self
+			names = set()
+			for node in nodes:
+				assert not node._parentref, "%s: cannot remount" % node.name
+				if node.name in self._children or node.name in names:
+					raise NameExists(node.name)
+				names.add(node.name)
+			targets = [_deref(node) for node in nodes]
+			keys = [(index, [index.key(target) for target in targets]) for index in self._indexes.values()]
+			with _indexing(self, subtrees = nodes) as root:
+				for node in nodes:
+					self._children[node.name] = node
+					node._parentref = weakref.ref(self)
+				for index, values in keys:
+					for node, value in itertools.izip(nodes, values):
+						index.insert(node.name, value)
+				if root:
+					prefix = _path_of(self, root).rstrip("/") + "/"
+					for node in nodes:
+						root._add_to_index(_walk_subtree(node, prefix + node.name))
+
+	def _unlink(self, children):
+		"remove children from the children, their indexes and the flat index of the root, the caller holds the lock"
+		with _indexing(self, subtrees = children) as root:
+			for child in children:
+				del self._children[child.name]
+				child._parentref = None
+				for index in self._indexes.values():
+					index.remove(child.name)
+			if root:
+				prefix = _path_of(self, root).rstrip("/") + "/"
+				for child in children:
+					root._remove_from_index(_walk_subtree(child, prefix + child.name))
+
+	def _detach(self, children):
+		"remove children in one locked section, none of them if one is no longer mounted here"
+		with self.lock:
+			for child in children:
+				if self._children.get(child.name) is not child:
+					raise NoSuchName(child.name)
+			self._unlink(children)
 
 	def mount(self, node):
+		self._attach((node,))
+		_notify((("link" if isinstance(node, Link) else "mount", self, node),))
+		return node
+
+	def watch(self, recursive = False, callback = None, queue = None):
+		"return a Watch of the children of this node, or its descendants if $recursive"
+		watch = Watch(self, recursive = recursive, callback = callback, queue = queue)
 		with self.lock:
-			assert not node._parentref, "%s: cannot remount" % node.name
-			if node.name in self._children:
-				raise NameExists(node.name)
-			self._children[node.name] = node
-			node._parentref = weakref.ref(self)
-			return node
+			self._watches += (watch,)
+			with _watch_lock:
+				_watch_stats["watches"] += 1
+		return watch
 
 	def link(self, node):
 		return self.mount(Link(_deref(node)))
@@ -75,17 +603,17 @@ class Node(object):
 
 	def _split(self, path):
 		"split a relative path '<name>/...' into a pair (children[<name>], '...')"
-		if path.startswith(self.path):
+		if path.startswith("/") and path.startswith(self.path): # absolute, unmounted nodes only take relative paths
 			path = path.replace(self.path, "", 1)
 			assert path, "cannot split current node path"
 		if "/" in path:
 			name, tail = path.split("/", 1)
 		else:
 			name, tail = path, None
-		with self.lock:
-			if not name in self._children:
-				raise NoSuchName(name)
-			return self._children[name], tail
+		child = self._children.get(name)
+		if child is None:
+			raise NoSuchName(name)
+		return child, tail
 
 	def umount(self, path, precondition = None):
 		path = Path(path)
@@ -94,11 +622,12 @@ class Node(object):
 			return child.umount(tail, precondition = precondition)
 		else:
 			with self.lock:
-				child = _deref(child)
-				assert not precondition or precondition(child), "%s: umount precondition violated" % path
-				del self._children[child.name]
-				child._parentref = None
-				return child
+				node = _deref(child)
+				assert not precondition or precondition(node), "%s: umount precondition violated" % path
+				self._unlink((child,))
+			_invalidate(child)
+			_notify((("umount", self, child),))
+			return node
 
 	def get(self, path):
 		"return the node at path"
@@ -109,16 +638,61 @@ class Node(object):
 			child, tail = self._split(path)
 			return child.get(tail) if tail else _deref(child)
 
-	def select(self, by_value = False, predicate = None, key = None, reverse = False):
+	def add_index(self, name, key, buckets = False):
+		"""
+		index the children by key(child), links by the key of their target:
+		  * a sorted index answers range and top-k queries, a bucketed one equality queries
+		  * keys are computed on mount, re-add the index if they change while mounted
+		"""
+		index = (_BucketIndex if buckets else _SortedIndex)(key)
 		with self.lock:
-			predicate = predicate or (lambda node: True)
-			pairs = [(name, _deref(node)) for name, node in self._children.items() if predicate(_deref(node))]
-			if key:
-				pairs.sort(key = lambda pair: key(pair[1]), reverse = reverse)
-			if by_value:
-				return tuple(node for _, node in pairs)
-			else:
-				return tuple(name for name, _ in pairs)
+			index.add_many((name, _deref(child)) for name, child in self._children.items())
+			self._indexes[name] = index
+
+	def remove_index(self, name):
+		with self.lock:
+			del self._indexes[name]
+
+	def select(self, by_value = False, predicate = None, key = None, reverse = False, index = None, lo = None, hi = None, limit = None):
+		"""
+		return the names, or nodes if $by_value, of the children matching predicate:
+		  * if $index is set, only the children whose key is in [lo, hi] are considered,
+		    in key order, from the index instead of the whole children dict
+		  * if $limit is set, return at most $limit children, e.g. the top-k with $reverse
+		"""
+		if index is None:
+			pairs = ((name, _deref(node)) for name, node in self._children.items())
+		else:
+			pairs = (
+				(name, _deref(node))
+				for name, node in ((name, self._children.get(name)) for name in self._indexes[index].names(lo, hi, reverse and not key))
+				if node is not None)
+		if predicate:
+			pairs = ((name, node) for name, node in pairs if predicate(node))
+		if key:
+			pairs = sorted(pairs, key = lambda pair: key(pair[1]), reverse = reverse)
+		if limit is not None:
+			pairs = itertools.islice(pairs, limit)
+		if by_value:
+			return tuple(node for _, node in pairs)
+		else:
+			return tuple(name for name, _ in pairs)
+
+	def walk(self, depth = None, follow_links = False):
+		"""
+		yield the pairs (path, node) of this node and its descendants, in no particular order:
+		  * if $depth is set, stop $depth levels below this node
+		  * if $follow_links, descend into link targets, unless already on the branch
+		"""
+		return _walk(self, self.path, depth, follow_links)
+
+	def glob(self, pattern, follow_links = False):
+		"""
+		yield the pairs (path, node) of the descendants matching the pattern, in no particular order:
+		  * the pattern is relative to this node, e.g. 'a/*/b/**'
+		  * '*', '?' and '[...]' match within a name, '**' matches zero or more names
+		"""
+		return _glob(self, self.path, _compile(pattern), follow_links)
 
 	def __div__(self, obj):
 		"syntactic sugar to build paths, e.g. <node> / <str> => path"
@@ -130,15 +704,213 @@ class Node(object):
 
 class Root(Node):
 
+	def __init__(self, name, indexed = False):
+		"""
+		if $indexed, maintain a flat index of the full path of every mounted node,
+		so that get(), exists() and is_link() on a full path are a dict lookup
+		"""
+		super(Root, self).__init__(name)
+		self._index = {} if indexed else None
+		self._index_lock = threading.Lock()
+
 	@property
 	def path(self): return "/"
 
+	def _add_to_index(self, pairs):
+		"index the (path, node) pairs, the caller holds the index lock"
+		for path, node in pairs:
+			self._index[path] = node
+
+	def _remove_from_index(self, pairs):
+		"unindex the (path, node) pairs, the caller holds the index lock"
+		for path, _ in pairs:
+			self._index.pop(path, None)
+
+	def mount_many(self, pairs):
+		"""
+		mount each node of the (path, node) pairs, in order, and return the nodes:
+		  * a path is resolved once, or not at all if it is a node of the batch,
+		    links of the batch are dereferenced as get() does
+		  * consecutive pairs sharing a path are mounted in one locked section, i.e.
+		    the parent and index locks are taken once per run of siblings, not per node
+		  * if a mount fails, the previous ones are rolled back before re-raising
+		  * watches get one batch, nodes mounted under a node of the batch are not reported
+		"""
+		parents = {}
+		mounted = [] # (parent, nodes) runs, attached
+		parent = nodes = None # pending run
+		try:
+			for path, node in pairs:
+				if parent is None or parents.get(path) is not parent:
+					if nodes:
+						parent._attach(nodes)
+						mounted.append((parent, nodes))
+					parent = parents.get(path)
+					if parent is None:
+						parent = parents[path] = self.get(path)
+					nodes = []
+				nodes.append(node)
+				parents[path.rstrip("/") + "/" + node.name] = _deref(node)
+			if nodes:
+				parent._attach(nodes)
+				mounted.append((parent, nodes))
+		except:
+			for parent, nodes in reversed(mounted):
+				parent._detach(nodes)
+			for _, nodes in mounted:
+				for node in nodes:
+					_invalidate(node)
+			raise
+		batch = set(id(node) for _, nodes in mounted for node in nodes)
+		tops = tuple((parent, node) for parent, nodes in mounted if not id(parent) in batch for node in nodes)
+		with batched():
+			_notify(("link" if isinstance(node, Link) else "mount", parent, node) for parent, node in tops)
+		return tuple(node for _, nodes in mounted for node in nodes)
+
+	def umount_many(self, paths, precondition = None):
+		"""
+		umount each path, in order, and return the unmounted nodes:
+		  * links are unmounted, not their targets
+		  * consecutive paths sharing a parent are unmounted in one locked section
+		  * if an umount fails, the previous ones are rolled back before re-raising
+		"""
+		unmounted = [] # (parent, children) runs, detached
+		dirname = parent = children = names = None # pending run
+		try:
+			for path in paths:
+				path = Path(path)
+				head, name = path.rstrip("/").rsplit("/", 1)
+				if head != dirname:
+					if children:
+						parent._detach(children)
+						unmounted.append((parent, children))
+					dirname = head
+					parent = self.get(dirname or "/")
+					children = []
+					names = set()
+				child = parent._children.get(name)
+				if child is None or name in names:
+					raise NoSuchName(name)
+				assert not precondition or precondition(_deref(child)), "%s: umount precondition violated" % path
+				children.append(child)
+				names.add(name)
+			if children:
+				parent._detach(children)
+				unmounted.append((parent, children))
+		except:
+			for parent, children in reversed(unmounted):
+				parent._attach(children)
+			raise
+		for _, children in unmounted:
+			for child in children:
+				_invalidate(child)
+		with batched():
+			_notify(("umount", parent, child) for parent, children in unmounted for child in children)
+		return tuple(_deref(child) for _, children in unmounted for child in children)
+
+	def dump(self, fp, encode = None):
+		"""
+		write a binary snapshot of the tree to the file object fp:
+		  * the payload of a node is the string encode(node), empty if $encode is not set
+		  * links are stored by target path, links whose target is gone or not mounted
+		    under this root are dropped
+		  * secondary indexes and watches are not stored
+		"""
+		encode = encode or (lambda node: "")
+		offset = [len(_MAGIC)]
+		def write(node, data, offsets):
+			name = node.name.encode("utf-8") if isinstance(node.name, unicode) else node.name
+			record = _RECORD.pack(isinstance(node, Link), len(name), len(data), len(offsets)) \
+				+ name \
+				+ data \
+				+ struct.pack("<%iQ" % len(offsets), *offsets)
+			fp.write(record)
+			offset[0] += len(record)
+			return offset[0] - len(record)
+		fp.write(_MAGIC)
+		stack = [(self, iter(self._children.values()), [])]
+		while stack: # post-order, a record refers to the offsets of the records of its children
+			node, children, offsets = stack[-1]
+			for child in children:
+				if isinstance(child, Link):
+					target = child.node_ref()
+					data = target and _path_of(target, self)
+					if data: # dangling otherwise, or to a node not mounted under this root
+						offsets.append(write(child, data, ()))
+				elif child._children:
+					stack.append((child, iter(child._children.values()), []))
+					break
+				else:
+					offsets.append(write(child, encode(child), ()))
+			else:
+				stack.pop()
+				if stack:
+					stack[-1][2].append(write(node, encode(node), offsets))
+				else:
+					fp.write(struct.pack("<Q", write(node, "", offsets)) + _MAGIC)
+
+	def load(self, fp, decode = None, lazy = False):
+		"""
+		mount the tree of the snapshot read from the file object fp under this empty root:
+		  * a node is built by decode(name, payload), a plain Node if $decode is not set
+		  * nodes are linked to their parent directly, no path is resolved
+		  * links are resolved on first dereference
+		  * if $lazy, the children of a node are only decoded on first access and are
+		    not added to the flat index, get() then walks down to them
+		"""
+		snapshot = _Snapshot(fp, decode or (lambda name, data: Node(name)), lazy)
+		with self.lock, self._index_lock:
+			assert not self._children, "%s: cannot load into a non-empty root" % self.name
+			self._children = snapshot.children(self, snapshot.root()[3])
+			if self._index is not None and not lazy:
+				self._add_to_index(itertools.chain.from_iterable(
+					_walk_subtree(child, "/" + child.name) for child in self._children.values()))
+
+	def _reset(self):
+		with self.lock, _indexing(self, subtrees = self._children.values()):
+			children = self._children.values()
+			self._children = {}
+			for child in children:
+				child._parentref = None
+			for index in self._indexes.values():
+				index.clear()
+			if self._index is not None:
+				self._index = {}
+		for child in children:
+			_invalidate(child)
+
+	def is_link(self, path):
+		node = self._index.get(path) if self._index is not None else None
+		return isinstance(node, Link) if node else super(Root, self).is_link(path)
+
+	def get(self, path):
+		node = self._index.get(path) if self._index is not None else None
+		return _deref(node) if node else super(Root, self).get(path)
+
 class Link(Node):
 
 	def __init__(self, node):
 		super(Link, self).__init__(node.name)
 		self.node_ref = weakref.ref(node)
 
+class _LazyLink(Link):
+	"link loaded from a snapshot, resolved on first dereference"
+
+	def __init__(self, name, target):
+		Node.__init__(self, name)
+		self.target = target
+
+	def node_ref(self):
+		"return the target, None if it is gone, like a dead weakref"
+		root = _root_of(self)
+		try:
+			node = root.get(self.target) if root else None
+		except NoSuchName:
+			node = None
+		if node is not None:
+			self.node_ref = weakref.ref(node)
+		return node
+
 class Null(Node):
 
 	def mount(self, node):
@@ -147,32 +919,427 @@ class Null(Node):
 	def link(self, node):
 		return node
 
-__root = Root("__root")
+#############
+# snapshots #
+#############
+
+# layout: _MAGIC, records, offset of the root record (Q), _MAGIC
+# record: is link (B), name length (I), data length (I), children count (I), name, data, children offsets (Q each)
+# data is the encoded payload of a node, the target path of a link
+
+_MAGIC = "PATH\x01"
+
+_RECORD = struct.Struct("<BIII")
+
+# serializes the decoding of lazily loaded children:
+_snapshot_lock = threading.Lock()
+
+class _Snapshot(object):
+	"decoder of the records of a snapshot, shared by the nodes lazily loaded from it"
+
+	def __init__(self, fp, decode, lazy):
+		try:
+			self.buf = mmap.mmap(fp.fileno(), 0, access = mmap.ACCESS_READ)
+		except (AttributeError, ValueError, EnvironmentError): # no file descriptor, or an empty file
+			self.buf = fp.read()
+		assert self.buf[:len(_MAGIC)] == _MAGIC and self.buf[-len(_MAGIC):] == _MAGIC, "not a path snapshot"
+		self.decode = decode
+		self.lazy = lazy
+
+	def record(self, offset):
+		"return the tuple (is link, name, data, children offsets) of the record at offset"
+		is_link, namelen, datalen, cnt = _RECORD.unpack_from(self.buf, offset)
+		offset += _RECORD.size
+		name = self.buf[offset:offset + namelen]
+		offset += namelen
+		data = self.buf[offset:offset + datalen]
+		offset += datalen
+		return is_link, name, data, struct.unpack_from("<%iQ" % cnt, self.buf, offset)
+
+	def root(self):
+		(offset,) = struct.unpack_from("<Q", self.buf, len(self.buf) - len(_MAGIC) - 8)
+		return self.record(offset)
+
+	def children(self, parent, offsets):
+		"return the children dict of parent, built from the records at offsets"
+		result = {}
+		stack = [(parent, offsets, result)]
+		while stack:
+			parent, offsets, children = stack.pop()
+			parentref = weakref.ref(parent)
+			for offset in offsets:
+				is_link, name, data, grandchildren = self.record(offset)
+				if is_link:
+					child = _LazyLink(name, data)
+				else:
+					child = self.decode(name, data)
+					if self.lazy and grandchildren:
+						del child._children
+						child._snapshot = (self, grandchildren)
+					elif grandchildren:
+						stack.append((child, grandchildren, child._children))
+				child._parentref = parentref
+				children[name] = child
+		return result
+
+class _Local(object):
+	"the operations of the module-level functions, on a Root of this process"
+
+	def __init__(self, root):
+		self.root = root
+
+	def get(self, path):
+		return self.root.get(path)
+
+	def link(self, path, node):
+		return self.root.get(path).link(node)
+
+	def is_link(self, path):
+		return self.root.is_link(path)
+
+	def reset(self):
+		self.root._reset()
+
+	def mount(self, path, node):
+		return self.root.get(path).mount(node)
+
+	def mount_many(self, pairs):
+		return self.root.mount_many(pairs)
+
+	def umount_many(self, paths, precondition = None):
+		return self.root.umount_many(paths, precondition = precondition)
+
+	def watch(self, path, recursive = False, callback = None, queue = None):
+		return self.root.get(path).watch(recursive = recursive, callback = callback, queue = queue)
+
+	def dump(self, fp, encode = None):
+		self.root.dump(fp, encode = encode)
+
+	def load(self, fp, decode = None, lazy = False):
+		self.root.load(fp, decode = decode, lazy = lazy)
+
+	def umount(self, path, precondition = None):
+		return self.root.umount(path, precondition = precondition)
+
+	def select(self, path, **kwargs):
+		return self.root.get(path).select(**kwargs)
+
+	def walk(self, path, depth = None, follow_links = False):
+		return _walk(self.root.get(path), path, depth, follow_links)
+
+	def glob(self, pattern, follow_links = False):
+		return self.root.glob(pattern, follow_links = follow_links)
+
+	def exists(self, path):
+		try:
+			self.root.get(path)
+			return True
+		except NoSuchName:
+			return False
+
+############
+# sharding #
+############
+
+# attributes of a node not sent to or from a shard:
+_TRANSIENT = ("lock", "_parentref", "_children", "_path", "_indexes", "_watches")
+
+def _pack_node(node):
+	"return the triple (class, attributes, packed children) of node, links by target path"
+	if isinstance(node, Link):
+		target = node.target if isinstance(node, _LazyLink) else node.node_ref().path
+		return _LazyLink, {"name": node.name, "target": target}, []
+	node._children # decode lazily loaded children
+	return type(node), dict((name, value) for name, value in node.__dict__.items() if not name in _TRANSIENT), []
+
+def _unpack(packed):
+	"return the node, and its subtree, built from _Packed"
+	def build((cls, state, _)):
+		node = object.__new__(cls)
+		Node.__init__(node, state["name"])
+		node.__dict__.update(state)
+		return node
+	top = build(packed)
+	stack = [(top, packed[2])]
+	while stack:
+		parent, children = stack.pop()
+		for child_packed in children:
+			child = build(child_packed)
+			child._parentref = weakref.ref(parent)
+			parent._children[child.name] = child
+			stack.append((child, child_packed[2]))
+	return top
+
+class _Packed(object):
+	"""
+	wrapper sending a node to or from a shard, unpickled as a copy of the node:
+	  * the copy has no lock, parent, cached path, indexes nor watches of its own
+	  * the subtree is copied too, unless $shallow
+	"""
+
+	def __init__(self, node, shallow = False):
+		self.node = node
+		self.shallow = shallow
+
+	def __reduce__(self):
+		packed = _pack_node(self.node)
+		stack = [] if self.shallow else [(self.node, packed)]
+		while stack:
+			node, (_, _, children) = stack.pop()
+			for child in node._children.values():
+				child_packed = _pack_node(child)
+				children.append(child_packed)
+				stack.append((child, child_packed))
+		return _unpack, (packed,)
+
+def _shallow(node):
+	"return node to send it without its subtree, roots are not sent"
+	if node is None or isinstance(node, Root):
+		return None
+	return _Packed(node, shallow = True)
+
+# how the nodes of the results of an operation are sent back:
+_REPLIES = {
+	"get": _shallow,
+	"select": lambda result: tuple(_shallow(item) if isinstance(item, Node) else item for item in result),
+	"walk": lambda result: [(path, _shallow(node)) for path, node in result],
+	"glob": lambda result: [(path, _shallow(node)) for path, node in result],
+	"umount": _Packed,
+	"umount_many": lambda result: tuple(_Packed(node) for node in result),
+	"mount": lambda result: None,
+	"mount_many": lambda result: None,
+}
+
+def _serve(conn, name, indexed):
+	"run the requests (op, args, kwargs) received on conn against a local root, until None"
+	local = _Local(Root(name, indexed = indexed))
+	while True:
+		try:
+			request = conn.recv()
+		except EOFError:
+			return
+		if request is None:
+			return
+		op, args, kwargs = request
+		try:
+			result = getattr(local, op)(*args, **kwargs)
+			if op in ("walk", "glob"):
+				result = list(result)
+			if op in _REPLIES:
+				result = _REPLIES[op](result)
+			conn.send((True, result))
+		except Exception as exc:
+			conn.send((False, exc))
+
+class ShardedRoot(object):
+	"""
+	root spreading its top-level subtrees across worker processes, with the
+	signatures of the module-level functions but not their semantics, so it
+	cannot be passed to set_root():
+	  * a path is owned by shard crc32(top-level name) % $shards, a worker process
+	    running a Root, requests and replies go through a pipe per shard
+	  * nodes are copied across processes: mount() copies the node and its subtree,
+	    get(), select(), walk() and glob() return childless copies, changing them,
+	    e.g. get(path).mount(node), does not change the tree, use mount(path, node)
+	  * get('/') is not supported, there is no root node to return
+	  * callables, e.g. predicate or key, are pickled: use module-level functions
+	  * select(), walk() and glob() on '/' query all the shards and merge the results
+	  * mount_many() and umount_many() are atomic per shard only
+	  * there are no links, watches nor snapshots, a tree needing them must use a Root
+	  * requests cost a pipe round-trip and a pickling of their arguments and
+	    results, reads are several times slower than on a Root until the shards
+	    run on enough cores to make up for it, see bench_path.py --shards
+	"""
+
+	def __init__(self, name = "__root", shards = None, indexed = True):
+		self.name = name
+		self.shards = []
+		for _ in xrange(shards or multiprocessing.cpu_count()):
+			conn, child_conn = multiprocessing.Pipe()
+			process = multiprocessing.Process(target = _serve, args = (child_conn, name, indexed))
+			process.daemon = True
+			process.start()
+			child_conn.close()
+			self.shards.append((conn, threading.Lock(), process))
+
+	def close(self):
+		for conn, lock, process in self.shards:
+			with lock:
+				conn.send(None)
+			process.join()
+			conn.close()
+		self.shards = []
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc_info):
+		self.close()
+
+	def _shard(self, path):
+		"return the index of the shard owning the top-level name of path"
+		return (zlib.crc32(path.strip("/").split("/", 1)[0]) & 0xffffffff) % len(self.shards)
+
+	def _call(self, shards, op, *args, **kwargs):
+		"run the operation on the shards, concurrently, and return their results"
+		locked = [self.shards[shard] for shard in shards]
+		for conn, lock, _ in locked:
+			lock.acquire()
+		try:
+			for conn, _, _ in locked:
+				conn.send((op, args, kwargs))
+			replies = [conn.recv() for conn, _, _ in locked]
+		finally:
+			for _, lock, _ in locked:
+				lock.release()
+		for ok, result in replies:
+			if not ok:
+				raise result
+		return [result for _, result in replies]
+
+	def _all(self):
+		return xrange(len(self.shards))
+
+	def get(self, path):
+		assert path.strip("/"), "cannot get a sharded root"
+		return self._call((self._shard(path),), "get", path)[0]
+
+	def is_link(self, path):
+		return self._call((self._shard(path),), "is_link", path)[0]
+
+	def reset(self):
+		self._call(self._all(), "reset")
+
+	def mount(self, path, node):
+		self._call((self._shard(path if path.strip("/") else node.name),), "mount", path, _Packed(node))
+		return node
+
+	def mount_many(self, pairs):
+		pairs = tuple(pairs)
+		batches = {}
+		for path, node in pairs:
+			batches.setdefault(self._shard(path if path.strip("/") else node.name), []).append((path, _Packed(node)))
+		for shard, batch in batches.items():
+			self._call((shard,), "mount_many", batch)
+		return tuple(node for _, node in pairs)
+
+	def umount_many(self, paths, precondition = None):
+		paths = tuple(paths)
+		batches = {}
+		for path in paths:
+			batches.setdefault(self._shard(path), []).append(path)
+		nodes = {}
+		for shard, batch in batches.items():
+			nodes.update(zip(batch, self._call((shard,), "umount_many", batch, precondition = precondition)[0]))
+		return tuple(nodes[path] for path in paths)
+
+	def umount(self, path, precondition = None):
+		return self._call((self._shard(path),), "umount", path, precondition = precondition)[0]
+
+	def select(self, path, by_value = False, predicate = None, key = None, reverse = False, index = None, lo = None, hi = None, limit = None):
+		if path.strip("/"):
+			return self._call((self._shard(path),), "select", path,
+				by_value = by_value,
+				predicate = predicate,
+				key = key,
+				reverse = reverse,
+				index = index,
+				lo = lo,
+				hi = hi,
+				limit = limit)[0]
+		assert index is None, "sharded root: no index on /"
+		nodes = [
+			node
+			for result in self._call(self._all(), "select", path, by_value = True, predicate = predicate)
+			for node in result]
+		if key:
+			nodes.sort(key = key, reverse = reverse)
+		if limit is not None:
+			nodes = nodes[:limit]
+		return tuple(nodes) if by_value else tuple(node.name for node in nodes)
+
+	def walk(self, path, depth = None, follow_links = False):
+		if path.strip("/"):
+			return iter(self._call((self._shard(path),), "walk", path, depth = depth, follow_links = follow_links)[0])
+		return self._merge(self._call(self._all(), "walk", path, depth = depth, follow_links = follow_links))
+
+	def glob(self, pattern, follow_links = False):
+		name = pattern.strip("/").split("/", 1)[0]
+		if name and name != "**" and not any(char in name for char in "*?["):
+			return iter(self._call((self._shard(pattern),), "glob", pattern, follow_links = follow_links)[0])
+		return self._merge(self._call(self._all(), "glob", pattern, follow_links = follow_links))
+
+	def _merge(self, results):
+		"yield the pairs (path, node) of the shards, '/' once, as this root"
+		for i, result in enumerate(results):
+			for path, node in result:
+				if path != "/":
+					yield path, node
+				elif not i:
+					yield path, self
+
+	def exists(self, path):
+		return not path.strip("/") or self._call((self._shard(path),), "exists", path)[0]
+
+__root = _Local(Root("__root", indexed = True))
+
+def set_root(root):
+	"run the module-level functions on root and return the previous one"
+	global __root
+	assert isinstance(root, Root), "%s: expected a Root, use a ShardedRoot directly" % type(root).__name__
+	previous, __root = __root.root, _Local(root)
+	return previous
 
 def get(path):
 	return __root.get(path)
 
 def link(path, node):
-	return __root.get(path).link(node)
+	return __root.link(path, node)
 
 def is_link(path):
 	return __root.is_link(path)
 
 def reset():
-	__root._children = {}
+	__root.reset()
+	_cache_stats.update(hits = 0, misses = 0)
 
 def mount(path, node):
-	return __root.get(path).mount(node)
+	return __root.mount(path, node)
+
+def mount_many(pairs):
+	return __root.mount_many(pairs)
+
+def umount_many(paths, precondition = None):
+	return __root.umount_many(paths, precondition = precondition)
+
+def watch(path, recursive = False, callback = None, queue = None):
+	return __root.watch(path, recursive = recursive, callback = callback, queue = queue)
 
-def umount(path, precondition = lambda node: True):
+def dump(fp, encode = None):
+	__root.dump(fp, encode = encode)
+
+def load(fp, decode = None, lazy = False):
+	__root.load(fp, decode = decode, lazy = lazy)
+
+def umount(path, precondition = None):
 	return __root.umount(path, precondition = precondition)
 
-def select(path, by_value = False, predicate = None, key = None, reverse = False):
-	return __root.get(path).select(by_value = by_value, predicate = predicate, key = key, reverse = reverse)
+def select(path, by_value = False, predicate = None, key = None, reverse = False, index = None, lo = None, hi = None, limit = None):
+	return __root.select(path,
+		by_value = by_value,
+		predicate = predicate,
+		key = key,
+		reverse = reverse,
+		index = index,
+		lo = lo,
+		hi = hi,
+		limit = limit)
+
+def walk(path, depth = None, follow_links = False):
+	return __root.walk(path, depth = depth, follow_links = follow_links)
+
+def glob(pattern, follow_links = False):
+	return __root.glob(pattern, follow_links = follow_links)
 
 def exists(path):
-	try:
-		__root.get(path)
-		return True
-	except NoSuchName:
-		return False
+	return __root.exists(path)
@@ -1,21 +1,22 @@
 # copyright (c) 2014-2015 fclaerhout.fr, released under the MIT license.
+# coding: utf-8
 
-def strtree(
+def iterlines(
 	iterable,
 	maxlen = 80,
 	use_ascii = False,
 	is_pre_prunable = lambda it: False,
 	is_post_prunable = lambda it: False):
 	"""
-	Return iterable as a pretty tree string.
-	  * uses utf8 lines by default, set $use_ascii if your terminal has not UCS support
-	  * lines are cut at $maxlen characters
-	  * nodes satisfying $is_pre_prunable are pruned without being walked
-	  * nodes satisfying $is_post_prunable are pruned if empty after the walk
+	Yield the lines of iterable as a pretty tree, see strtree().
+	  * the tree is walked with an explicit stack, memory is O(depth)
+	  * a line is yielded as soon as its node is known not to be pruned: the line of a
+	    node is deferred until one of its children is printed or it is walked entirely
 	"""
 	subprefix = "|  " if use_ascii else unicode("│  ", "utf-8")
 	midprefix = "+-- " if use_ascii else unicode("├─ ", "utf-8")
 	lastprefix = "`-- " if use_ascii else unicode("└─ ", "utf-8")
+	suffix = "..." if use_ascii else unicode("…", "utf-8")
 	def _lookahead(iterable):
 		"""
 		On each iteration, return the pair (element, is_last).
@@ -30,34 +31,51 @@ def strtree(
 	def _truncline(string):
 		"truncate line if too long"
 		if len(string) > maxlen:
-			suffix = "..." if use_ascii else unicode("…", "utf-8")
 			return "%s%s" % (string[:maxlen - len(suffix)], suffix)
 		else:
 			return string
-	def _get_lines(iterable):
-		"return list of lines properly prefixed"
-		if is_pre_prunable(iterable):
-			return []
+	if is_pre_prunable(iterable):
+		return
+	# each frame is (node, children, prefix of the lines of the children, line)
+	stack = [(iterable, _lookahead(iterable), "", "%s" % iterable)]
+	printed = 0 # the lines of stack[:printed] are printed, the others are deferred
+	while stack:
+		node, children, indent, _ = stack[-1]
+		for child, is_last_child in children:
+			if not is_pre_prunable(child):
+				stack.append((
+					child,
+					_lookahead(child),
+					"%s%s" % (indent, "   " if is_last_child else subprefix),
+					"%s%s%s" % (indent, lastprefix if is_last_child else midprefix, "%s" % child)))
+				break
 		else:
-			lines = ["%s" % iterable]
-			cnt = 0
-			for child, is_last_child in _lookahead(iterable):
-				prefix = lastprefix if is_last_child else midprefix
-				child_lines = _get_lines(child)
-				if child_lines:
-					cnt += 1
-				for line, is_last_line in _lookahead(child_lines):
-					if child_lines.index(line) == 0:
-						lines.append("%s%s" % (prefix, line))
-					elif is_last_child:
-						lines.append("   %s" % line)
-					else:
-						lines.append("%s%s" % (subprefix, line))
-			if not cnt and is_post_prunable(iterable):
-				return []
-			else:
-				return lines
-	return "\n".join(map(_truncline, _get_lines(iterable)))
+			if printed < len(stack) and not is_post_prunable(node):
+				for _, _, _, line in stack[printed:]:
+					yield _truncline(line)
+				printed = len(stack)
+			stack.pop()
+			printed = min(printed, len(stack))
+
+def strtree(
+	iterable,
+	maxlen = 80,
+	use_ascii = False,
+	is_pre_prunable = lambda it: False,
+	is_post_prunable = lambda it: False):
+	"""
+	Return iterable as a pretty tree string.
+	  * uses utf8 lines by default, set $use_ascii if your terminal has not UCS support
+	  * lines are cut at $maxlen characters
+	  * nodes satisfying $is_pre_prunable are pruned without being walked
+	  * nodes satisfying $is_post_prunable are pruned if empty after the walk
+	"""
+	return "\n".join(iterlines(
+		iterable,
+		maxlen = maxlen,
+		use_ascii = use_ascii,
+		is_pre_prunable = is_pre_prunable,
+		is_post_prunable = is_post_prunable))
 
 
 def strcolalign(obj):
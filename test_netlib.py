@@ -1,6 +1,6 @@
 # copyright (c) 2015 fclaerhout.fr, released under the MIT license.
 
-import unittest
+import tempfile, unittest, random, os
 
 import netlib # 3rd-party
 
@@ -39,6 +39,19 @@ class SelfTest(unittest.TestCase):
 			netlib.Ip4(172, 16, 42, 3),
 		))
 
+	def test_ip4_value_type(self):
+		ip = netlib.Ip4("10.0.0.1")
+		self.assertEqual({ip: 42}[netlib.Ip4(10, 0, 0, 1)], 42)
+		self.assertRaises(AttributeError, setattr, ip, "value", 0)
+		self.assertRaises(AttributeError, setattr, ip, "foo", 0)
+		self.assertEqual(ip + 1, netlib.Ip4("10.0.0.2"))
+		self.assertRaises(AssertionError, lambda: netlib.Ip4("255.255.255.255") + 1)
+
+	def test_subnet_ints(self):
+		n = netlib.Subnet("172.16.42.0/30")
+		self.assertEqual(tuple(n.ints()), tuple(int(ip) for ip in n))
+		self.assertEqual(len(netlib.Subnet("10/8").ints()), 2 ** 24)
+
 	def test_subnet_size(self):
 		n = netlib.Subnet("192.0.2.0/24")
 		self.assertEqual(len(n), 256)
@@ -56,6 +69,33 @@ class SelfTest(unittest.TestCase):
 			netlib.Subnet("192.168.1.224/27"),
 		))
 
+	def test_subnet_subnets(self):
+		n = netlib.Subnet("10/8")
+		subnets = n.subnets(30)
+		self.assertEqual(next(subnets), netlib.Subnet("10.0.0.0/30"))
+		self.assertEqual(next(subnets), netlib.Subnet("10.0.0.4/30"))
+
+	def test_subnet_view(self):
+		n = netlib.Subnet("10/8")
+		self.assertEqual(n[10000], netlib.Ip4("10.0.39.16"))
+		self.assertEqual(n[-1], netlib.Ip4("10.255.255.255"))
+		self.assertRaises(IndexError, lambda: n[2 ** 24])
+		self.assertEqual(n.index(netlib.Ip4("10.0.39.16")), 10000)
+		self.assertEqual(n.count(netlib.Ip4("11.0.0.0")), 0)
+		self.assertEqual(next(reversed(n)), netlib.Ip4("10.255.255.255"))
+		s = n[256::256]
+		self.assertEqual(len(s), 2 ** 16 - 1)
+		self.assertEqual(tuple(s[:2]), (netlib.Ip4("10.0.1.0"), netlib.Ip4("10.0.2.0")))
+		self.assertEqual(s.index(netlib.Ip4("10.0.2.0")), 1)
+		self.assertRaises(ValueError, s.index, netlib.Ip4("10.0.2.1"))
+
+	def test_sequence_slicing(self):
+		seq = netlib.IpSequence(0, 100, 3)
+		ref = range(0, 100, 3)
+		for key in (slice(None), slice(5, None, 2), slice(None, None, -1), slice(-3, 2, -4), slice(50, 60), slice(10, 2)):
+			self.assertEqual(tuple(seq[key].ints()), tuple(ref[key]))
+			self.assertEqual(tuple(reversed(seq[key])), tuple(netlib.Ip4(i) for i in reversed(ref[key])))
+
 	def test_range_iter(self):
 		r = netlib.Range("172.16.42.0", "172.16.42.3")
 		self.assertEqual(tuple(r), (
@@ -77,4 +117,286 @@ class SelfTest(unittest.TestCase):
 		for idx, item in enumerate(r):
 			self.assertEqual(r.index(item), idx)
 
+	def test_ip4set(self):
+		s = netlib.Ip4Set(("10.0.0.3", netlib.Ip4(10, 0, 0, 1), 167772161))
+		self.assertEqual(len(s), 2)
+		self.assertEqual(tuple(s.ip4s()), (netlib.Ip4(10, 0, 0, 1), netlib.Ip4(10, 0, 0, 3)))
+		self.assertIn("10.0.0.3", s)
+		self.assertNotIn(netlib.Ip4(10, 0, 0, 2), s)
+		self.assertEqual(s.contains_many(("10.0.0.1", "10.0.0.2")), (True, False))
+		s.add("10.0.0.2")
+		s.discard("10.0.0.3")
+		self.assertEqual(tuple(s), (167772161, 167772162))
+
+	def test_ip4set_operations(self):
+		a = netlib.Ip4Set(netlib.Subnet("10.0.0.0/30"))
+		b = netlib.Ip4Set(netlib.Subnet("10.0.0.2/31"))
+		self.assertEqual(a | b, a)
+		self.assertEqual(a & b, b)
+		self.assertEqual(tuple((a - b).ip4s()), (netlib.Ip4(10, 0, 0, 0), netlib.Ip4(10, 0, 0, 1)))
+
+	def test_prefix_table(self):
+		t = netlib.PrefixTable((
+			(netlib.Subnet("10/8"), "a"),
+			(netlib.Subnet("10.1/16"), "b"),
+			(netlib.Subnet("10.1.2/24"), "c"),
+			(netlib.Subnet("192.168/16"), "d")))
+		self.assertEqual(len(t), 4)
+		self.assertEqual(t.lookup("10.1.2.3"), (netlib.Subnet("10.1.2/24"), "c"))
+		self.assertEqual(t.lookup(netlib.Ip4("10.1.3.3")), (netlib.Subnet("10.1/16"), "b"))
+		self.assertEqual(t.lookup("10.2.0.1")[1], "a")
+		self.assertRaises(KeyError, t.lookup, "172.16.0.1")
+		self.assertEqual(
+			tuple(value for _, value in t.covering(netlib.Subnet("10.1.2.128/25"))),
+			("c", "b", "a"))
+		self.assertEqual(
+			tuple(value for _, value in t.covered_by(netlib.Subnet("10/8"))),
+			("a", "b", "c"))
+		del t[netlib.Subnet("10.1.2/24")]
+		self.assertEqual(t.lookup("10.1.2.3")[1], "b")
+		self.assertEqual(tuple(t)[-1], netlib.Subnet("192.168/16"))
+
+	def test_parse_many(self):
+		self.assertEqual(
+			tuple(netlib.parse_many("10.0.0.1\n192.168.010.255\n255.255.255.255")),
+			(167772161, 3232238335, 4294967295))
+		self.assertEqual(
+			tuple(netlib.parse_many(("0.0.0.0", u"1.2.3.4"))),
+			(0, netlib.ip4str_to_int32("1.2.3.4")))
+		try:
+			netlib.parse_many(("1.2.3.4", "1.2.3", "1.2.3.256", "a.b.c.d"))
+		except netlib.InvalidIp4Rows as exc:
+			self.assertEqual(exc.args, ((1, "1.2.3"), (2, "1.2.3.256"), (3, "a.b.c.d")))
+		else:
+			self.fail("InvalidIp4Rows not raised")
+
+	def test_format_many(self):
+		rows = ["10.0.0.1", "192.168.10.255", "0.0.0.0", "255.255.255.255"]
+		self.assertEqual(netlib.format_many(netlib.parse_many(rows)), rows)
+		self.assertEqual(netlib.format_many([netlib.Ip4("172.16.0.1")]), ["172.16.0.1"])
+
+	def test_range_to_cidrs(self):
+		self.assertEqual(netlib.range_to_cidrs(netlib.Range("10.0.0.1", "10.0.0.10")), (
+			netlib.Subnet("10.0.0.1/32"),
+			netlib.Subnet("10.0.0.2/31"),
+			netlib.Subnet("10.0.0.4/30"),
+			netlib.Subnet("10.0.0.8/31"),
+			netlib.Subnet("10.0.0.10/32"),
+		))
+		self.assertEqual(
+			netlib.range_to_cidrs(netlib.Range("0.0.0.0", "255.255.255.255")),
+			(netlib.Subnet("0/0"),))
+
+	def test_collapse(self):
+		self.assertEqual(netlib.collapse(()), ())
+		self.assertEqual(netlib.collapse((
+			netlib.Subnet("10.0.1/24"),
+			netlib.Range("10.0.0.0", "10.0.0.127"),
+			netlib.Subnet("10.0.0.128/25"),
+			netlib.Subnet("10.0.1.64/26"),
+			netlib.Ip4("192.168.0.1"),
+		)), (
+			netlib.Subnet("10.0.0/23"),
+			netlib.Subnet("192.168.0.1/32"),
+		))
+
+	def test_address_pool(self):
+		pool = netlib.AddressPool(
+			netlib.Subnet("192.168.0.0/29"),
+			reserved = (netlib.Ip4("192.168.0.0"), netlib.Ip4("192.168.0.7")))
+		self.assertEqual(pool.used, 2)
+		subnet = pool.allocate_subnet(31)
+		self.assertIn(subnet, (netlib.Subnet("192.168.0.2/31"), netlib.Subnet("192.168.0.4/31")))
+		ips = set((pool.allocate(), pool.allocate(), pool.allocate(), pool.allocate()))
+		self.assertEqual(len(ips), 4)
+		self.assertRaises(netlib.PoolExhausted, pool.allocate)
+		self.assertEqual(pool.utilization(), 1.0)
+		clone = netlib.AddressPool.loads(pool.dumps())
+		self.assertEqual(clone.used, 8)
+		self.assertRaises(netlib.AddressInUse, clone.reserve, netlib.Ip4("192.168.0.1"))
+		pool.free(subnet)
+		for ip in ips:
+			pool.free(ip)
+		self.assertEqual(pool.used, 2)
+		self.assertRaises(netlib.PoolExhausted, pool.allocate_subnet, 30)
+		pool.free(netlib.Ip4("192.168.0.7"))
+		self.assertEqual(pool.allocate_subnet(30), netlib.Subnet("192.168.0.4/30"))
+
+	def test_ip6(self):
+		ip = netlib.Ip6("2001:DB8:0:0:0:0:0:1")
+		self.assertEqual(str(ip), "2001:db8::1")
+		self.assertEqual(ip.split(), (0x2001, 0xdb8, 0, 0, 0, 0, 0, 1))
+		self.assertEqual(netlib.Ip6(int(ip)), ip)
+		self.assertEqual(str(netlib.Ip6("::ffff:10.0.0.1")), "::ffff:10.0.0.1")
+		self.assertNotEqual(netlib.Ip6(1), netlib.Ip4(1))
+		self.assertRaises(netlib.InvalidIp6Initializer, netlib.Ip6, "2001:db8:::1")
+		self.assertEqual(ip + 1, netlib.Ip6("2001:db8::2"))
+
+	def test_subnet6(self):
+		n = netlib.Subnet("2001:db8::/32")
+		self.assertEqual(n.size, 2 ** 96)
+		self.assertEqual(str(n.bcastid), "2001:db8:ffff:ffff:ffff:ffff:ffff:ffff")
+		self.assertIn(netlib.Ip6("2001:db8::1"), n)
+		self.assertNotIn(netlib.Ip4("10.0.0.1"), n)
+		self.assertEqual(n[-1], n.bcastid)
+		subnets = n.subnets(64)
+		next(subnets)
+		self.assertEqual(next(subnets), netlib.Subnet("2001:db8:0:1::/64"))
+		self.assertEqual(tuple(netlib.Subnet("2001:db8::/127")), (netlib.Ip6("2001:db8::"), netlib.Ip6("2001:db8::1")))
+
+	def test_subnet6_size(self):
+		n = netlib.Subnet("2001:db8::/32")
+		self.assertRaises(OverflowError, len, n)
+		self.assertRaises(OverflowError, len, n.view())
+		self.assertEqual(n.view().size, 2 ** 96)
+		r = netlib.Range("::", "ffff::")
+		self.assertEqual(r.size, 0xffff * 2 ** 112 + 1)
+		self.assertEqual(r[-1], netlib.Ip6("ffff::"))
+		self.assertEqual(tuple(n[1:3]), (netlib.Ip6("2001:db8::1"), netlib.Ip6("2001:db8::2")))
+		self.assertEqual(n[-2:].size, 2)
+		self.assertEqual(n[::-1][0], n.bcastid)
+		self.assertEqual(n[::2 ** 95].size, 2)
+		self.assertEqual(tuple(n[2:1]), ())
+		seq = netlib.IpSequence(0, 10)
+		for key in (slice(None, None, -3), slice(-4, None), slice(8, 2, -2), slice(-20, 20, 4)):
+			self.assertEqual([int(ip) for ip in seq[key]], range(10)[key])
+
+	def test_mixed_families(self):
+		self.assertRaises(TypeError, lambda: netlib.Ip4(1) < netlib.Ip6(2))
+		self.assertRaises(TypeError, lambda: netlib.Ip6(1) >= netlib.Ip4(0))
+		self.assertRaises(AssertionError, netlib.Ip4Set, (netlib.Ip6("::1"),))
+		self.assertRaises(AssertionError, netlib.classify, netlib.Ip6("::1"))
+		subnet = netlib.Subnet("::/126")
+		self.assertFalse(netlib.Ip4(1) in subnet.view())
+		self.assertFalse(netlib.Ip6(1) in netlib.Subnet("0.0.0.0/30").view())
+		self.assertRaises(ValueError, subnet.index, netlib.Ip4(2))
+		self.assertEqual(subnet.index(netlib.Ip6(2)), 2)
+
+	def test_dual_stack(self):
+		t = netlib.PrefixTable((
+			(netlib.Subnet("10/8"), 4),
+			(netlib.Subnet("2001:db8::/32"), 6),
+			(netlib.Subnet("2001:db8:1::/48"), 48)))
+		self.assertEqual(t.lookup("10.0.0.1")[1], 4)
+		self.assertEqual(t.lookup("2001:db8::1")[1], 6)
+		self.assertEqual(t.lookup(netlib.Ip6("2001:db8:1::1")), (netlib.Subnet("2001:db8:1::/48"), 48))
+		self.assertRaises(KeyError, t.lookup, "::a00:1")
+		self.assertEqual(len(t.covered_by(netlib.Subnet("2001:db8::/32"))), 2)
+		self.assertEqual(netlib.collapse((
+			netlib.Subnet("2001:db8::/33"),
+			netlib.Subnet("2001:db8:8000::/33"),
+			netlib.Range("10.0.0.0", "10.0.0.3"),
+			netlib.Range("::a00:0", "::a00:3"),
+		)), (
+			netlib.Subnet("10.0.0.0/30"),
+			netlib.Subnet("::a00:0/126"),
+			netlib.Subnet("2001:db8::/32"),
+		))
+
+	def test_ip4_classful(self):
+		self.assertTrue(netlib.Ip4("0.0.0.0").is_class_a())
+		self.assertTrue(netlib.Ip4("127.255.255.255").is_class_a())
+		self.assertTrue(netlib.Ip4("128.0.0.0").is_class_b())
+		self.assertTrue(netlib.Ip4("192.168.0.1").is_class_c())
+		self.assertTrue(netlib.Ip4("224.0.0.1").is_class_d())
+		self.assertTrue(netlib.Ip4("255.255.255.255").is_class_e())
+		self.assertFalse(netlib.Ip4("192.168.0.1").is_class_b())
+
+	def test_classify(self):
+		self.assertEqual(netlib.classify("10.1.2.3"), netlib.CLASS_A | netlib.IS_PRIVATE)
+		self.assertEqual(netlib.classify(netlib.Ip4("172.31.0.1")), netlib.CLASS_B | netlib.IS_PRIVATE)
+		self.assertEqual(netlib.classify("172.32.0.1"), netlib.CLASS_B)
+		self.assertEqual(netlib.classify("127.0.0.1"), netlib.CLASS_A | netlib.IS_LOOPBACK)
+		self.assertEqual(netlib.classify("169.254.1.1"), netlib.CLASS_B | netlib.IS_LINK_LOCAL)
+		self.assertEqual(netlib.classify("239.1.1.1"), netlib.CLASS_D | netlib.IS_MULTICAST)
+		self.assertEqual(netlib.classify("0.1.2.3"), netlib.CLASS_A | netlib.IS_RESERVED)
+		self.assertEqual(netlib.classify("250.0.0.1"), netlib.CLASS_E | netlib.IS_RESERVED)
+		values = netlib.parse_many(("192.168.1.1", "8.8.8.8"))
+		self.assertEqual(tuple(netlib.classify_many(values)), (netlib.CLASS_C | netlib.IS_PRIVATE, netlib.CLASS_A))
+
+	def _load_subnets(self, text, **kwargs):
+		fd, path = tempfile.mkstemp()
+		try:
+			os.write(fd, text)
+			os.close(fd)
+			return tuple(
+				(tuple(netids), tuple(prefixes))
+				for netids, prefixes in netlib.load_subnets(path, **kwargs))
+		finally:
+			os.remove(path)
+
+	def test_load_subnets(self):
+		self.assertEqual(self._load_subnets(""), ())
+		batches = self._load_subnets("# prefixes\n10/8\n\n172.16/12\r\n192.168.1/24\n 192.168.2.0/24 \n1.2.3.4/32", batch_size = 3)
+		self.assertEqual(batches, (
+			((0x0A000000, 0xAC100000, 0xC0A80100), (8, 12, 24)),
+			((0xC0A80200, 0x01020304), (24, 32)),
+		))
+		self.assertEqual(
+			self._load_subnets("10/8\n172.16/12\n", chunk_size = 1),
+			(((0x0A000000, 0xAC100000), (8, 12)),))
+		try:
+			self._load_subnets("10/8\n10.0.0.1/24\n10.0.0.0/33\n10/x\n")
+		except netlib.InvalidSubnetRows as exc:
+			self.assertEqual(exc.args, ((2, "10.0.0.1/24"), (3, "10.0.0.0/33"), (4, "10/x")))
+		else:
+			self.fail("InvalidSubnetRows not raised")
+		try:
+			self._load_subnets("10/8\n256.0.0.0/8\n")
+		except netlib.InvalidSubnetRows as exc:
+			self.assertEqual(exc.args, ((2, "256.0.0.0/8"),))
+		else:
+			self.fail("InvalidSubnetRows not raised")
+
+	def test_interval_index(self):
+		index = netlib.IntervalIndex((
+			(netlib.Range("10.0.0.10", "10.0.0.19"), "a"),
+			(netlib.Subnet("10.0.0.16/28"), "b"),
+			(netlib.Ip4("10.0.0.40"), "c"),
+			(netlib.Subnet("2001:db8::/64"), "d")))
+		self.assertEqual(len(index), 4)
+		self.assertEqual(tuple(value for _, value in index.items()), ("a", "b", "c", "d"))
+		self.assertEqual(tuple(value for _, value in index.stab("10.0.0.17")), ("a", "b"))
+		self.assertEqual(tuple(value for _, value in index.stab("10.0.0.20")), ("b",))
+		self.assertEqual(index.stab("10.0.0.9"), ())
+		self.assertEqual(
+			tuple(value for _, value in index.overlapping(netlib.Range("10.0.0.0", "10.0.0.40"))),
+			("a", "b", "c"))
+		self.assertEqual(tuple(value for _, value in index.stab("2001:db8::1")), ("d",))
+		self.assertEqual(index.next_free("10.0.0.12"), netlib.Ip4("10.0.0.32"))
+		self.assertEqual(index.next_free("10.0.0.12", size = 9), netlib.Ip4("10.0.0.41"))
+		self.assertEqual(index.next_free("10.0.0.0", size = 10), netlib.Ip4("10.0.0.0"))
+		self.assertEqual(index.next_free("255.255.255.255", size = 2), None)
+		index.remove(netlib.Subnet("10.0.0.16/28"))
+		self.assertNotIn(netlib.Subnet("10.0.0.16/28"), index)
+		self.assertEqual(index.next_free("10.0.0.12"), netlib.Ip4("10.0.0.20"))
+		self.assertRaises(KeyError, index.remove, netlib.Subnet("10.0.0.16/28"))
+		index[netlib.Ip4("10.0.0.40")] = "e"
+		self.assertEqual(index[netlib.Ip4("10.0.0.40")], "e")
+		self.assertEqual(len(index), 3)
+
+	def test_interval_index_random(self):
+		rand = random.Random(0)
+		index = netlib.IntervalIndex()
+		ranges = set()
+		for _ in xrange(500):
+			first = rand.randrange(1000)
+			ranges.add((first, first + rand.randrange(1, 50)))
+		for first, last in ranges:
+			index.insert(netlib.Range(first, last))
+		for first, last in sorted(ranges)[::2]:
+			index.remove(netlib.Range(first, last))
+			ranges.remove((first, last))
+		for ip in xrange(0, 1100, 7):
+			self.assertEqual(
+				sorted((int(r.first), int(r.last)) for r, _ in index.stab(ip)),
+				sorted((first, last) for first, last in ranges if first <= ip <= last))
+		used = set(ip for first, last in ranges for ip in xrange(first, last + 1))
+		for ip in xrange(0, 1100, 7):
+			for size in (1, 2, 5, 20):
+				free = ip
+				while any(free + offset in used for offset in xrange(size)):
+					free += 1
+				self.assertEqual(index.next_free(ip, size), netlib.Ip4(free))
+
 if __name__ == "__main__": unittest.main(verbosity = 2)
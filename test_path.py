@@ -1,9 +1,18 @@
 # copyright (c) 2015 fclaerhout.fr, released under the MIT license.
 
-import threading, unittest, random, time, sys
+import threading, unittest, tempfile, random, copy, time, sys, os
 
 import path # 3rd-party
 
+class XNode(path.Node):
+
+	def __init__(self, name, x):
+		super(XNode, self).__init__(name)
+		self.x = x
+
+def get_x(node):
+	return node.x
+
 class Test(unittest.TestCase):
 
 	def setUp(self):
@@ -74,6 +83,313 @@ class Test(unittest.TestCase):
 		path.umount("/bar/foo")
 		self.assertEqual(path.get("/foo"), foo)
 
+	def test_index(self):
+		root = path.Root("root", indexed = True)
+		foo = path.Node("foo")
+		bar = foo.mount(path.Node("bar")) # unmounted subtree, indexed on mount
+		root.mount(foo)
+		baz = bar.mount(path.Node("baz"))
+		self.assertEqual(set(root._index), set(("/foo", "/foo/bar", "/foo/bar/baz")))
+		self.assertEqual(root.get("/foo/bar/baz"), baz)
+		root.mount(path.Node("qux"))
+		root.get("/qux").link(bar)
+		self.assertTrue(root.is_link("/qux/bar"))
+		self.assertEqual(root.get("/qux/bar"), bar)
+		root.umount("/foo/bar")
+		self.assertEqual(set(root._index), set(("/foo", "/qux", "/qux/bar")))
+		self.assertRaises(path.NoSuchName, root.get, "/foo/bar/baz")
+		root.umount("/qux/bar")
+		self.assertEqual(set(root._index), set(("/foo", "/qux")))
+		self.assertEqual(foo.path, "/foo")
+
+	def test_path_cache(self):
+		foo = path.mount("/", path.Node("foo"))
+		bar = path.mount("/foo", path.Node("bar"))
+		self.assertEqual(bar.path, "/foo/bar")
+		hits, misses = path.cache_info()
+		self.assertEqual(bar.path, "/foo/bar")
+		self.assertEqual(path.cache_info(), (hits + 1, misses))
+		path.umount("/foo")
+		self.assertRaises(AssertionError, lambda: bar.path)
+		path.mount("/", path.Node("qux"))
+		path.mount("/qux", foo)
+		self.assertEqual(bar.path, "/qux/foo/bar")
+		self.assertEqual(path.get("/qux/foo/bar"), bar)
+
+	def test_mount_many(self):
+		foo, bar, baz = path.Node("foo"), path.Node("bar"), path.Node("baz")
+		self.assertEqual(path.mount_many((("/", foo), ("/foo", bar), ("/foo/bar", baz))), (foo, bar, baz))
+		self.assertEqual(path.get("/foo/bar/baz"), baz)
+		self.assertEqual(baz.path, "/foo/bar/baz")
+		qux = path.Node("qux")
+		self.assertRaises(path.NameExists, path.mount_many, (("/foo", qux), ("/foo", path.Node("bar"))))
+		self.assertFalse(path.exists("/foo/qux"))
+		self.assertEqual(path.select("/foo"), ("bar",))
+		self.assertRaises(path.NoSuchName, path.mount_many, (("/foo", qux), ("/nope", path.Node("x"))))
+		self.assertFalse(path.exists("/foo/qux"))
+		self.assertRaises(path.NameExists, path.mount_many, (
+			("/", path.Node("a")),
+			("/foo", qux),
+			("/foo", path.Node("qux"))))
+		self.assertFalse(path.exists("/a"))
+		self.assertFalse(path.exists("/foo/qux"))
+		path.mount("/foo", qux)
+		x, c = path.Node("x"), path.Node("c")
+		path.mount_many((("/", x), ("/", path.Node("y")), ("/y", path.Link(x)), ("/y/x", c)))
+		self.assertEqual(path.select("/x"), ("c",))
+		self.assertEqual(c.path, "/x/c")
+		a, b = path.Node("a"), path.Node("b")
+		def pairs():
+			yield "/", a
+			yield "/a", b
+			yield "/", path.Node("z")
+			self.assertEqual(b.path, "/a/b") # cached during the batch
+			yield "/", path.Node("a")
+		self.assertRaises(path.NameExists, path.mount_many, pairs())
+		path.mount("/x", b)
+		self.assertEqual(b.path, "/x/b")
+
+	def test_umount_many(self):
+		path.mount_many((
+			("/", path.Node("foo")),
+			("/foo", path.Node("bar")),
+			("/foo", path.Node("baz"))))
+		self.assertRaises(path.NoSuchName, path.umount_many, ("/foo/bar", "/foo/nope"))
+		self.assertEqual(set(path.select("/foo")), set(("bar", "baz")))
+		self.assertTrue(path.exists("/foo/bar"))
+		self.assertRaises(path.NoSuchName, path.umount_many, ("/foo", "/foo/bar"))
+		self.assertTrue(path.exists("/foo/bar"))
+		self.assertRaises(path.NoSuchName, path.umount_many, ("/foo/bar", "/foo/bar"))
+		self.assertTrue(path.exists("/foo/bar"))
+		bar, baz = path.umount_many(("/foo/bar", "/foo/baz"))
+		self.assertEqual((bar.name, baz.name), ("bar", "baz"))
+		self.assertFalse(path.exists("/foo/bar"))
+		self.assertEqual(path.select("/foo"), ())
+		self.assertRaises(AssertionError, lambda: bar.path)
+
+	def test_select_index(self):
+		class XNode(path.Node):
+			def __init__(self, name, x):
+				super(XNode, self).__init__(name)
+				self.x = x
+		foo = path.mount("/", path.Node("foo"))
+		foo.add_index("x", key = lambda node: node.x)
+		foo.add_index("parity", key = lambda node: node.x % 2, buckets = True)
+		path.mount_many(("/foo", XNode("n%i" % i, i)) for i in xrange(100))
+		self.assertEqual(path.select("/foo", index = "x", reverse = True, limit = 3), ("n99", "n98", "n97"))
+		self.assertEqual(path.select("/foo", index = "x", lo = 10, hi = 12), ("n10", "n11", "n12"))
+		self.assertEqual(
+			path.select("/foo", index = "x", lo = 10, predicate = lambda node: node.x % 10 == 0, limit = 2),
+			("n10", "n20"))
+		self.assertEqual(len(path.select("/foo", index = "parity", lo = 1, hi = 1)), 50)
+		path.umount("/foo/n99")
+		path.umount_many(("/foo/n98", "/foo/n1"))
+		self.assertEqual(path.select("/foo", index = "x", reverse = True, limit = 2), ("n97", "n96"))
+		self.assertEqual(len(path.select("/foo", index = "parity", lo = 1, hi = 1)), 48)
+		path.link("/foo", path.mount("/", XNode("bar", 1000)))
+		self.assertEqual(path.select("/foo", index = "x", lo = 500, by_value = True), (path.get("/bar"),))
+		self.assertEqual(
+			path.select("/foo", index = "x", hi = 3, key = lambda node: -node.x),
+			("n3", "n2", "n0"))
+		self.assertRaises(AssertionError, path.select, "/foo", index = "parity", lo = 0)
+		self.assertRaises(AttributeError, path.mount, "/foo", path.Node("nox"))
+		self.assertFalse(path.exists("/foo/nox"))
+		self.assertNotIn("nox", path.select("/foo"))
+
+	def test_select_index_concurrent(self):
+		foo = path.mount("/", path.Node("foo"))
+		foo.add_index("x", key = get_x)
+		path.mount_many(("/foo", XNode("n%03i" % i, i)) for i in xrange(300))
+		names = foo._indexes["x"].names()
+		self.assertEqual([next(names) for _ in xrange(100)], ["n%03i" % i for i in xrange(100)])
+		path.umount_many("/foo/n%03i" % i for i in xrange(50))
+		path.mount("/foo", XNode("early", -1))
+		self.assertEqual(list(names), ["n%03i" % i for i in xrange(100, 300)])
+		names = foo._indexes["x"].names(lo = 10, hi = 200, reverse = True)
+		self.assertEqual(next(names), "n200")
+		path.umount("/foo/n100")
+		path.mount("/foo", XNode("late", 500))
+		self.assertEqual(list(names), ["n%03i" % i for i in xrange(199, 49, -1) if i != 100])
+
+	def test_watch(self):
+		foo = path.mount("/", path.Node("foo"))
+		batches = []
+		with path.watch("/", recursive = True, callback = batches.append), path.watch("/foo") as watch:
+			bar = path.mount("/foo", path.Node("bar"))
+			path.link("/", bar)
+			path.umount("/bar")
+			self.assertEqual(batches, [
+				[("mount", "foo/bar", bar)],
+				[("link", "bar", bar)],
+				[("umount", "bar", bar)]])
+			del batches[:]
+			baz, qux = path.mount_many((("/foo/bar", path.Node("baz")), ("/foo", path.Node("qux"))))
+			self.assertEqual(batches, [[("mount", "foo/bar/baz", baz), ("mount", "foo/qux", qux)]])
+			del batches[:]
+			with path.batched():
+				path.umount("/foo/qux")
+				path.mount("/foo", qux)
+				path.mount("/foo/bar", path.Node("tmp"))
+				path.umount("/foo/bar/tmp")
+				self.assertEqual(batches, [])
+			self.assertEqual(batches, [[("umount", "foo/qux", qux), ("mount", "foo/qux", qux)]])
+		self.assertEqual(
+			list(watch),
+			[[("mount", "bar", bar)], [("mount", "qux", qux)], [("umount", "qux", qux), ("mount", "qux", qux)]])
+		path.umount("/foo/qux")
+		self.assertEqual(len(batches), 1)
+		self.assertEqual(path._watch_stats["watches"], 0)
+
+	def test_watch_errors(self):
+		import StringIO
+		def fail(events):
+			raise ValueError("oops")
+		stderr, sys.stderr = sys.stderr, StringIO.StringIO()
+		try:
+			with path.watch("/", callback = fail) as watch:
+				foo = path.mount("/", path.Node("foo"))
+				with path.batched():
+					path.umount("/foo")
+					path.mount("/", path.Node("bar"))
+			output = sys.stderr.getvalue()
+		finally:
+			sys.stderr = stderr
+		self.assertTrue(path.exists("/bar"))
+		self.assertFalse(path.exists("/foo"))
+		self.assertEqual(watch.errors, 2)
+		self.assertIn("ValueError: oops", output)
+		nodes = [path.mount("/", path.Node("n%i" % i)) for i in xrange(10)]
+		def f(node):
+			for _ in xrange(100):
+				node.watch(callback = fail).close()
+		pool = [threading.Thread(target = f, args = (node,)) for node in nodes]
+		map(lambda t: t.start(), pool)
+		map(lambda t: t.join(), pool)
+		self.assertEqual(path._watch_stats["watches"], 0)
+
+	def test_snapshot(self):
+		class XNode(path.Node):
+			def __init__(self, name, x):
+				super(XNode, self).__init__(name)
+				self.x = x
+		path.mount_many((
+			("/", XNode("foo", 1)),
+			("/foo", XNode("bar", 2)),
+			("/foo/bar", XNode("baz", 3)),
+			("/", XNode("qux", 4))))
+		path.link("/qux", path.get("/foo/bar"))
+		fd, name = tempfile.mkstemp()
+		os.close(fd)
+		try:
+			with open(name, "wb") as fp:
+				path.dump(fp, encode = lambda node: str(node.x))
+			for lazy in (False, True):
+				root = path.Root("root", indexed = True)
+				with open(name, "rb") as fp:
+					root.load(fp, decode = lambda name, data: XNode(name, int(data)), lazy = lazy)
+				self.assertEqual("_children" in root.get("/foo").__dict__, not lazy)
+				self.assertEqual(root.get("/foo/bar/baz").x, 3)
+				self.assertEqual(root.get("/foo/bar/baz").path, "/foo/bar/baz")
+				self.assertTrue(root.is_link("/qux/bar"))
+				self.assertEqual(root.get("/qux/bar"), root.get("/foo/bar"))
+				self.assertEqual(
+					set((p, getattr(node, "x", None)) for p, node in root.walk()),
+					set((("/", None), ("/foo", 1), ("/foo/bar", 2), ("/foo/bar/baz", 3), ("/qux", 4), ("/qux/bar", 2))))
+				root.mount(XNode("new", 5))
+				root.get("/foo/bar").mount(XNode("new", 6))
+				self.assertEqual(set(root.get("/foo/bar").select()), set(("baz", "new")))
+			root = path.Root("root")
+			with open(name, "rb") as fp:
+				root.load(fp, lazy = True)
+			link = root.get("/qux")._children["bar"]
+			root.umount("/foo/bar")
+			self.assertIs(link.node_ref(), None)
+			bar = path.umount("/foo/bar") # alive but unmounted
+			with open(name, "wb") as fp:
+				path.dump(fp)
+			self.assertTrue(path.is_link("/qux/bar"))
+			with open(name, "rb") as fp:
+				root = path.Root("root")
+				root.load(fp)
+			self.assertEqual(set(p for p, _ in root.walk()), set(("/", "/foo", "/qux")))
+		finally:
+			os.remove(name)
+
+	def test_sharded_root(self):
+		with path.ShardedRoot(shards = 3) as root:
+			self.assertRaises(AssertionError, path.set_root, root)
+			root.mount_many(("/", XNode("n%i" % i, i)) for i in xrange(20))
+			root.mount("/n3", XNode("foo", 100))
+			self.assertEqual(root.get("/n3/foo").x, 100)
+			self.assertEqual(root.get("/n3").select(), ()) # childless copy
+			self.assertEqual(root.select("/n3"), ("foo",))
+			self.assertEqual(root.select("/", key = get_x, reverse = True, limit = 3), ("n19", "n18", "n17"))
+			self.assertEqual(len(set(root._shard(name) for name in root.select("/"))), 3)
+			self.assertTrue(root.exists("/n3/foo"))
+			self.assertEqual(set(p for p, _ in root.glob("/*/foo")), set(("/n3/foo",)))
+			self.assertEqual(len(tuple(root.walk("/"))), 22)
+			node = root.umount("/n3")
+			self.assertEqual((node.x, node.select()), (3, ("foo",)))
+			self.assertEqual(node._children["foo"].x, 100) # copied with its subtree
+			self.assertIs(node._children["foo"]._parentref(), node)
+			self.assertFalse(root.exists("/n3/foo"))
+			self.assertRaises(path.NoSuchName, root.get, "/n3")
+			self.assertRaises(path.NoSuchName, root.mount, "/nope", XNode("bar", 0))
+			self.assertFalse(hasattr(root, "link"))
+			root.reset()
+			self.assertEqual(root.select("/"), ())
+		self.assertFalse(path.exists("/n4")) # the module-level root is untouched
+		foo = path.mount("/", path.Node("foo"))
+		bar = path.mount("/foo", path.Node("bar"))
+		copy.copy(foo) # nodes keep the default copy and pickle semantics
+		self.assertIs(bar._parentref(), foo)
+		self.assertEqual(path.umount("/foo/bar"), bar)
+
+	def test_walk(self):
+		"""
+		/
+		+- foo
+		   +- bar
+		      +- baz
+		   +- qux
+		      +- foo@
+		"""
+		path.mount_many((
+			("/", path.Node("foo")),
+			("/foo", path.Node("bar")),
+			("/foo/bar", path.Node("baz")),
+			("/foo", path.Node("qux"))))
+		path.link("/foo/qux", path.get("/foo"))
+		self.assertEqual(
+			set(p for p, _ in path.walk("/")),
+			set(("/", "/foo", "/foo/bar", "/foo/bar/baz", "/foo/qux", "/foo/qux/foo")))
+		self.assertEqual(set(p for p, _ in path.walk("/foo", depth = 1)), set(("/foo", "/foo/bar", "/foo/qux")))
+		self.assertEqual(
+			set(p for p, _ in path.walk("/foo/qux", follow_links = True)),
+			set(("/foo/qux", "/foo/qux/foo", "/foo/qux/foo/bar", "/foo/qux/foo/bar/baz", "/foo/qux/foo/qux", "/foo/qux/foo/qux/foo")))
+		self.assertEqual(dict(path.walk("/foo/qux"))["/foo/qux/foo"], path.get("/foo"))
+
+	def test_glob(self):
+		path.mount_many((
+			("/", path.Node("a")),
+			("/a", path.Node("x")),
+			("/a", path.Node("y")),
+			("/a/x", path.Node("b")),
+			("/a/x/b", path.Node("c")),
+			("/a/y", path.Node("b")),
+			("/a/y", path.Node("d"))))
+		self.assertEqual(set(p for p, _ in path.glob("/a/*/b")), set(("/a/x/b", "/a/y/b")))
+		self.assertEqual(set(p for p, _ in path.glob("/a/*/b/**")), set(("/a/x/b", "/a/x/b/c", "/a/y/b")))
+		self.assertEqual(set(p for p, _ in path.glob("/**/b")), set(("/a/x/b", "/a/y/b")))
+		self.assertEqual(sorted(p for p, _ in path.glob("/**/[bc]/**")), ["/a/x/b", "/a/x/b/c", "/a/y/b"])
+		self.assertEqual(set(p for p, _ in path.get("/a").glob("?")), set(("/a/x", "/a/y")))
+		self.assertEqual(tuple(path.glob("/a/z/**")), ())
+		path.link("/a/y/d", path.get("/a/x/b"))
+		self.assertEqual(set(p for p, _ in path.glob("/a/y/**/c")), set())
+		self.assertEqual(set(p for p, _ in path.glob("/a/y/**/c", follow_links = True)), set(("/a/y/d/b/c",)))
+		path.link("/a/x/b/c", path.get("/a"))
+		self.assertEqual(len(tuple(path.glob("/**", follow_links = True))), 12) # the cycle is cut at /a/x/b/c/a and /a/y/d/b/c/a
+
 	def test_concurrent_access(self):
 		"spawn $nb_threads threads where each thread iterates $nb_ops times mounting and unmounting a node from the root"
 		nb_threads = 100
@@ -98,4 +414,49 @@ class Test(unittest.TestCase):
 		map(lambda t: t.join(), pool)
 		self.assertFalse(exceptions)
 
+	def test_concurrent_index(self):
+		"mount and umount nodes under a directory concurrently unmounted and remounted, the flat index must follow"
+		root = path.Root("root", indexed = True)
+		parent = root.mount(path.Node("dir"))
+		exceptions = []
+		def f(i):
+			node = path.Node("node%i" % i)
+			for _ in xrange(200):
+				try:
+					if node._parentref:
+						parent.umount(node.name)
+					else:
+						parent.mount(node)
+				except Exception as exc:
+					exceptions.append(exc)
+					break
+		def g():
+			for _ in xrange(200):
+				root.umount("/dir")
+				root.mount(parent)
+		pool = [threading.Thread(target = lambda i = i: f(i)) for i in xrange(10)] + [threading.Thread(target = g)]
+		map(lambda t: t.start(), pool)
+		map(lambda t: t.join(), pool)
+		self.assertFalse(exceptions)
+		self.assertEqual(
+			sorted(root._index),
+			sorted(["/dir"] + ["/dir/%s" % name for name in parent._children]))
+
+	def test_concurrent_trees(self):
+		"writers of unrelated trees without flat index do not wait for each other"
+		roots = [path.Root("root0")]
+		nodes = [path.Node("foo")]
+		lock = path._subtree_lock(roots[0])
+		while path._subtree_lock(nodes[-1]) is lock: # locks are striped, skip collisions
+			nodes.append(path.Node("foo"))
+		roots.append(path.Root("root1"))
+		while path._subtree_lock(roots[-1]) is lock:
+			roots.append(path.Root("root%i" % len(roots)))
+		with path._indexing(roots[0]):
+			thread = threading.Thread(target = lambda: roots[-1].mount(nodes[-1]))
+			thread.start()
+			thread.join(5)
+			self.assertFalse(thread.is_alive())
+		self.assertEqual(roots[-1].get("/foo").name, "foo")
+
 if __name__ == "__main__": unittest.main(verbosity = 2)
@@ -30,7 +30,7 @@ class Test(unittest.TestCase):
 		class G(F): pass
 		res = tuple(val.cls for val in ClassTree(A))
 		self.assertEqual((B, E, F), res)
-		self.assertEqual(utils.strtree(ClassTree(A)), unicode("""A
+		self.assertEqual(strfmt.strtree(ClassTree(A)), unicode("""A
 ├─ B
 │  ├─ C
 │  └─ D
@@ -38,14 +38,50 @@ class Test(unittest.TestCase):
 └─ F
    └─ G""", "utf-8"))
 
+	def test_strtree_pruning(self):
+		class A(object): pass
+		class B(A): pass
+		class C(B): pass
+		class D(A): pass
+		class E(D): pass
+		self.assertEqual(
+			strfmt.strtree(ClassTree(A), use_ascii = True, is_pre_prunable = lambda it: it.cls is C),
+			"A\n+-- B\n`-- D\n   `-- E")
+		self.assertEqual(
+			strfmt.strtree(
+				ClassTree(A),
+				use_ascii = True,
+				is_pre_prunable = lambda it: it.cls is C,
+				is_post_prunable = lambda it: it.cls in (B, E)),
+			"A\n`-- D")
+
+	def test_strtree_repeated_lines(self):
+		tree = {"root": ("`-- x",), "`-- x": ("x",), "x": ()} # the 2 lines of "`-- x" are the same
+		class Node(object):
+			def __init__(self, name): self.name = name
+			__str__ = lambda self: self.name
+			__iter__ = lambda self: (Node(name) for name in tree[self.name])
+		self.assertEqual(
+			strfmt.strtree(Node("root"), use_ascii = True),
+			"root\n`-- `-- x\n   `-- x")
+
+	def test_iterlines_deep(self):
+		class Chain(object):
+			def __init__(self, depth): self.depth = depth
+			__str__ = lambda self: "n"
+			__iter__ = lambda self: iter((Chain(self.depth - 1),) if self.depth else ())
+		lines = strfmt.iterlines(Chain(5000), maxlen = 10)
+		self.assertEqual(next(lines), "n")
+		self.assertEqual(sum(1 for _ in lines), 5000)
+
 	def test_strcolalign_with_text(self):
 		text = "a:bbbbbb:c\naaa:b:c"
 		out = "a    bbbbbb  c\naaa  b       c"
-		self.assertEqual(utils.strcolalign(text), out)
+		self.assertEqual(strfmt.strcolalign(text), out)
 
 	def test_strcolalign_with_table(self):
 		tbl = (("a", "bbbbbb", "c"), ("aaa", "b", "c"))
 		out = "a    bbbbbb  c\naaa  b       c"
-		self.assertEqual(utils.strcolalign(tbl), out)
+		self.assertEqual(strfmt.strcolalign(tbl), out)
 
 if __name__ == "__main__": unittest.main(verbosity = 2)
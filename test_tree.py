@@ -0,0 +1,146 @@
+# copyright (c) 2014-2015 fclaerhout.fr, released under the MIT license.
+# coding: utf-8
+
+import unittest, tempfile, StringIO, shutil, sys, os
+
+import tree # 3rd-party
+
+class Test(unittest.TestCase):
+
+	def setUp(self):
+		"""
+		top
+		+- a
+		   +- b
+		      +- f (6 bytes)
+		   +- g (2 bytes)
+		+- c (10 bytes)
+		+- .git
+		   +- h (1 byte)
+		"""
+		self.top = tempfile.mkdtemp()
+		os.makedirs(os.path.join(self.top, "a", "b"))
+		os.makedirs(os.path.join(self.top, ".git"))
+		for name, data in (("a/b/f", "hello\n"), ("a/g", "x\n"), ("c", "0123456789"), (".git/h", "h")):
+			with open(os.path.join(self.top, name), "w") as fp:
+				fp.write(data)
+
+	def tearDown(self):
+		shutil.rmtree(self.top)
+
+	def _main(self, *args):
+		"return the output of tree on self.top"
+		stdout, sys.stdout = sys.stdout, StringIO.StringIO()
+		try:
+			tree.main(list(args) + [self.top])
+			return sys.stdout.getvalue()
+		finally:
+			sys.stdout = stdout
+
+	def test_backends(self):
+		for backend in (tree._listdir, tree._scandir) if tree.scandir else (tree._listdir,):
+			self.assertEqual(sorted(backend(self.top)), [(".git", True, None), ("a", True, None), ("c", False, None)])
+			self.assertEqual(sorted(backend(os.path.join(self.top, "a"), sizes = True)), [("b", True, None), ("g", False, 2)])
+
+	def test_prefetch(self):
+		def walk(node):
+			return [node.path] + [path for child in node for path in walk(child)]
+		walkers = [tree.Walker(backend = "listdir", jobs = jobs, is_excluded = lambda name: name == ".git") for jobs in (0, 4)]
+		try:
+			paths = [walk(tree.FSNode(self.top, toplevel = True, maxdepth = float("inf"), walker = walker)) for walker in walkers]
+		finally:
+			for walker in walkers:
+				walker.close()
+		self.assertEqual(paths[0], paths[1])
+		self.assertEqual(len(paths[0]), 6)
+		self.assertEqual((walkers[1].dirs, walkers[1].files), (2, 3))
+
+	def test_sort(self):
+		walker = tree.Walker(sizes = True, sort = "size", reverse = True, is_excluded = lambda name: name == ".git")
+		root = tree.FSNode(self.top, toplevel = True, maxdepth = float("inf"), walker = walker)
+		tree.aggregate(root)
+		self.assertEqual([child.basename for child in root], ["c", "a"])
+		walker.sort, walker.reverse = "name", False
+		self.assertEqual([child.basename for child in root], ["a", "c"])
+
+	def test_aggregate(self):
+		for maxdepth in (float("inf"), 1, 0):
+			walker = tree.Walker(sizes = True, is_excluded = lambda name: name == ".git")
+			root = tree.FSNode(self.top, toplevel = True, maxdepth = maxdepth, walker = walker)
+			tree.aggregate(root)
+			self.assertEqual((root.size, root.files, root.dirs), (18, 3, 2))
+			children = dict((child.basename, child) for child in root)
+			if maxdepth:
+				self.assertEqual((children["a"].size, children["a"].files, children["a"].dirs), (8, 2, 1))
+				self.assertEqual(list(children["a"]) != [], maxdepth > 1)
+			else:
+				self.assertEqual(children, {})
+		self.assertEqual((walker.dirs, walker.files, walker.bytes), (0, 0, 0)) # nothing printed below the root
+
+	def test_symlinks(self):
+		"symlinks are not followed, a cycle does not inflate the totals"
+		os.symlink("..", os.path.join(self.top, "a", "up"))
+		os.symlink("up", os.path.join(self.top, "a", "b", "up"))
+		for backend in (tree._listdir, tree._scandir) if tree.scandir else (tree._listdir,):
+			self.assertEqual(sorted(backend(os.path.join(self.top, "a"), sizes = True)), [("b", True, None), ("g", False, 2), ("up", False, 2)])
+		for maxdepth in (float("inf"), 1):
+			walker = tree.Walker(sizes = True, is_excluded = lambda name: name == ".git")
+			root = tree.FSNode(self.top, toplevel = True, maxdepth = maxdepth, walker = walker)
+			tree.aggregate(root)
+			self.assertEqual((root.size, root.files, root.dirs), (22, 5, 2))
+		output = self._main("--du", "-m", "1", "-s", "name").splitlines()
+		self.assertEqual(output[1], u"├─ [12B, 4 files]  a/")
+
+	def test_cache(self):
+		cache = {}
+		listed = []
+		def listdir(path, sizes = False):
+			listed.append(path)
+			return tree._listdir(path, sizes)
+		for _ in xrange(2):
+			walker = tree.Walker(cache = cache)
+			walker.backend = listdir
+			tree.aggregate(tree.FSNode(self.top, toplevel = True, maxdepth = float("inf"), walker = walker))
+			cache = walker.listed
+		self.assertEqual(len(listed), 4) # top, a, a/b and .git, once
+		self.assertFalse(walker.changed())
+		path = os.path.join(self.top, "a", "b")
+		os.utime(path, (0, 0))
+		self.assertTrue(walker.changed())
+
+	def test_main(self):
+		output = self._main("--du", "-m", "1", "-s", "name").splitlines()
+		self.assertEqual(output[1:3], [u"├─ [8B, 2 files]  a/", u"└─ [10B]  c"])
+		self.assertEqual(output[-1], "1 directories, 1 files, 10 bytes")
+		self.assertEqual(self._main("-x", "a,c").splitlines()[1:], [u"└─ .git/", u"   └─ h", "1 directories, 1 files"])
+		fd, path = tempfile.mkstemp()
+		os.close(fd)
+		try:
+			output = self._main("-s", "name")
+			self.assertEqual(self._main("-c", path, "-s", "name"), output) # cold
+			self.assertEqual(self._main("-c", path, "-s", "name"), output) # warm
+			self.assertEqual(set(tree._load_cache(path)), set((self.top, os.path.join(self.top, "a"), os.path.join(self.top, "a", "b"))))
+		finally:
+			os.remove(path)
+
+	def test_streaming(self):
+		"lines are printed as directories are listed, not once the tree is listed"
+		events = []
+		class Output(StringIO.StringIO):
+			def write(self, string):
+				events.append("print")
+				StringIO.StringIO.write(self, string)
+		def listdir(path, sizes = False):
+			events.append("list")
+			return tree._listdir(path, sizes)
+		stdout, sys.stdout = sys.stdout, Output()
+		backend, tree.BACKENDS["listdir"] = tree.BACKENDS["listdir"], listdir
+		try:
+			tree.main(["-b", "listdir", self.top])
+		finally:
+			sys.stdout = stdout
+			tree.BACKENDS["listdir"] = backend
+		self.assertEqual(events.count("list"), 3) # .git is excluded
+		self.assertTrue(events.index("print") < len(events) - events[::-1].index("list") - 1)
+
+if __name__ == "__main__": unittest.main(verbosity = 2)
@@ -11,55 +11,334 @@ Usage:
 Options:
   -x GLOBS, --exclude GLOBS  exclude matching nodes [default: .git]
   -m INT, --max-depth INT    set maximum depth [default: inf]
+  -b NAME, --backend NAME    list directories with listdir, scandir or auto [default: auto]
+  -j INT, --jobs INT         prefetch subdirectories in INT threads [default: 0]
+  -s KEY, --sort KEY         sort entries by name, size or none [default: none]
+  -r, --reverse              reverse the sort order
+  -S, --sizes                show the size of files
+  -d, --du                   show the total size and file count of directories, like du
+  -c FILE, --cache FILE      reuse the directory listings cached in FILE
+  -w, --watch                print the tree again whenever a listed directory changes
+  -i SECS, --interval SECS   check for changes every SECS seconds [default: 1]
   -h, --help                 display full help text
   -2                         equivalent to -m 2
+
+Backends:
+  listdir  os.listdir, then one lstat per entry to tell directories apart
+  scandir  os.scandir, or the scandir backport, using the directory entry types
+  auto     scandir if available, listdir otherwise
+
+Sizes:
+  Sizes are apparent sizes, read from the same stat as the entry type. With
+  the du option, or when sorting by size, the tree is listed in a single
+  post-order pass computing the totals of each directory before it is printed,
+  otherwise it is printed as it is listed. The totals cover the whole subtree
+  of a directory, the maximum depth only limits what is printed. Symbolic
+  links are not followed, as du does: a link is listed as a file of the size
+  of the link, a linked directory is not descended into.
+
+Cache:
+  A directory is listed again only if its inode or mtime changed since it was
+  cached, so a refresh costs a stat per directory. A file rewritten in place
+  keeps its cached size until its directory changes. The watch option polls
+  the listed directories the same way and keeps its cache in memory, or in FILE.
 """
 
-import fnmatch, os
+import multiprocessing.pool, cPickle, fnmatch, stat, time, sys, os
+
+import docopt, strfmt, utils # 3rd-party
+
+try:
+	from os import scandir
+except ImportError:
+	try:
+		from scandir import scandir # 3rd-party backport
+	except ImportError:
+		scandir = None
+
+def _listdir(path, sizes = False):
+	"""
+	return the triples (name, is directory, size) of the entries of path, with a lstat per entry:
+	  * the size of files is only set if $sizes, it is None otherwise and for directories
+	  * symlinks are not followed, they are files of the size of the link
+	"""
+	entries = []
+	for name in os.listdir(path):
+		try:
+			st = os.lstat(os.path.join(path, name))
+		except OSError: # removed since listed
+			continue
+		is_dir = stat.S_ISDIR(st.st_mode)
+		entries.append((name, is_dir, st.st_size if sizes and not is_dir else None))
+	return entries
+
+def _scandir(path, sizes = False):
+	"""
+	return the triples (name, is directory, size) of the entries of path, see _listdir():
+	  * only files are stat'ed, if $sizes
+	"""
+	entries = []
+	for entry in scandir(path):
+		is_dir = entry.is_dir(follow_symlinks = False)
+		size = None
+		if sizes and not is_dir:
+			try:
+				size = entry.stat(follow_symlinks = False).st_size
+			except OSError: # removed since listed
+				continue
+		entries.append((entry.name, is_dir, size))
+	return entries
+
+def _human(size):
+	"return a size in bytes as a short human-readable string, e.g. 4.0K"
+	for unit in "BKMGTP":
+		if size < 1024 or unit == "P":
+			break
+		size /= 1024.
+	return "%i%s" % (size, unit) if unit == "B" else "%.1f%s" % (size, unit)
+
+BACKENDS = {
+	"listdir": _listdir,
+	"scandir": _scandir,
+}
+
+class Walker(object):
+	"""
+	List directories with a backend:
+	  * entries satisfying $is_excluded are skipped
+	  * if $jobs is set, the subdirectories of a listed directory are listed ahead,
+	    concurrently, in a pool of $jobs threads
+	  * entries keep the backend order, whatever the order listings complete in,
+	    unless sorted by $sort, 'name' or 'size'
+	  * the numbers of directories, files and bytes listed are counted, bytes only if $sizes
+	  * if $cache is set, a dict path => ((inode, mtime), sizes, entries), listings are
+	    reused while the inode and mtime of their directory are unchanged, the listings
+	    of this walk are kept in self.listed, in the same format
+	"""
 
-import docopt, utils # 3rd-party
+	def __init__(self, backend = "auto", jobs = 0, is_excluded = lambda name: False, sizes = False, sort = None, reverse = False, cache = None):
+		if backend == "auto":
+			backend = "scandir" if scandir else "listdir"
+		assert backend in BACKENDS, "%s: unknown backend" % backend
+		assert backend != "scandir" or scandir, "scandir: backend unavailable, install the scandir backport"
+		assert sort in (None, "name", "size"), "%s: unknown sort key" % sort
+		self.backend = BACKENDS[backend]
+		self.pool = multiprocessing.pool.ThreadPool(jobs) if jobs else None
+		self.is_excluded = is_excluded
+		self.sizes = sizes
+		self.sort = sort
+		self.reverse = reverse
+		self.cache = cache
+		self.listed = {}
+		self.dirs = 0
+		self.files = 0
+		self.bytes = 0
+
+	def listdir(self, path):
+		if self.cache is None:
+			return self.backend(path, self.sizes)
+		st = os.stat(path)
+		key = (st.st_ino, st.st_mtime)
+		cached = self.cache.get(path)
+		if not cached or cached[0] != key or (self.sizes and not cached[1]):
+			cached = (key, self.sizes, self.backend(path, self.sizes))
+		self.listed[path] = cached
+		return cached[2]
+
+	def prefetch(self, path):
+		"return the pending listing of path, None if not prefetching"
+		if self.pool and not self.is_excluded(os.path.basename(path)):
+			return self.pool.apply_async(self.listdir, (path,))
+
+	def changed(self):
+		"return True if a directory listed by this walker changed since, False otherwise"
+		for path, (key, _, _) in self.listed.items():
+			try:
+				st = os.stat(path)
+			except OSError: # removed
+				return True
+			if (st.st_ino, st.st_mtime) != key:
+				return True
+		return False
+
+	def close(self):
+		if self.pool:
+			self.pool.terminate()
+			self.pool.join()
 
 class FSNode(object):
 
-	def __init__(self, path, toplevel, maxdepth):
+	def __init__(self, path, toplevel, maxdepth, walker = None, is_dir = None, listing = None, size = None):
 		self.path = path.rstrip("/")
 		self.basename = os.path.basename(self.path)
 		self.toplevel = toplevel
 		self.maxdepth = maxdepth
+		self.walker = walker or Walker(backend = "listdir")
+		self.size = size # of a file if listed with sizes, of the files below a directory once aggregated
+		self.files = 0 # below a directory, once aggregated
+		self.dirs = 0 # below a directory, once aggregated
+		self._is_dir = is_dir # as listed by the parent, stat'ed on first use otherwise
+		self._listing = listing # pending listing, if prefetched
+		self._children = None # once aggregated
 
 	def __str__(self):
 		name = self.basename.decode("utf-8", errors = "ignore")
-		return utils.blue("%s/") % name if self.is_directory() else name
+		if not self.is_directory():
+			return "[%s]  %s" % (_human(self.size), name) if self.size is not None else name
+		elif self.size is not None:
+			return "[%s, %i files]  %s" % (_human(self.size), self.files, utils.blue("%s/") % name)
+		else:
+			return utils.blue("%s/") % name
 
 	def is_directory(self):
-		return os.path.isdir(self.path)
+		if self._is_dir is None:
+			self._is_dir = os.path.isdir(self.path)
+		return self._is_dir
 
 	def is_readable(self):
 		return os.access(self.path, os.R_OK)
 
+	def _list(self, beyond = False):
+		"""
+		return the children, in backend order, and count them in the walker:
+		  * if $beyond, a directory at the maximum depth is listed too, for its
+		    totals, but its entries are not counted
+		"""
+		if (self.maxdepth <= 0 and not beyond) or not self.is_directory():
+			return []
+		try:
+			entries = self._listing.get() if self._listing else self.walker.listdir(self.path)
+		except OSError: # unreadable
+			return []
+		finally:
+			self._listing = None
+		children = []
+		for name, is_dir, size in entries:
+			if self.walker.is_excluded(name):
+				continue
+			path = os.path.join(self.path, name)
+			children.append(FSNode(
+				path,
+				toplevel = False,
+				maxdepth = self.maxdepth - 1,
+				walker = self.walker,
+				is_dir = is_dir,
+				listing = self.walker.prefetch(path) if is_dir and (beyond or self.maxdepth > 1) else None,
+				size = size))
+			if self.maxdepth <= 0:
+				continue # beyond the maximum depth
+			if is_dir:
+				self.walker.dirs += 1
+			else:
+				self.walker.files += 1
+				self.walker.bytes += size or 0
+		return children
+
 	def __iter__(self):
-		if self.maxdepth and self.is_directory() and self.is_readable():
-			for name in os.listdir(self.path):
-				yield FSNode(
-					os.path.join(self.path, name),
-					toplevel = False,
-					maxdepth = self.maxdepth - 1)
+		children = self._children if self._children is not None else self._list()
+		if self.walker.sort == "name":
+			children = sorted(children, key = lambda child: child.basename, reverse = self.walker.reverse)
+		elif self.walker.sort == "size":
+			children = sorted(children, key = lambda child: child.size, reverse = self.walker.reverse)
+		for child in children:
+			yield child
+
+def aggregate(root):
+	"""
+	list the tree under root in a single post-order pass:
+	  * the children of each directory are kept, iterating over the tree does not list it again
+	  * the size, file and directory counts of each directory are the totals below it,
+	    directories beyond the maximum depth are listed for the totals but not kept
+	"""
+	root.size = 0
+	children = root._list(beyond = True)
+	root._children = children if root.maxdepth > 0 else []
+	stack = [(root, iter(children))]
+	while stack:
+		node, children = stack[-1]
+		for child in children:
+			if child.is_directory():
+				child.size = 0
+				children = child._list(beyond = True)
+				child._children = children if child.maxdepth > 0 else []
+				stack.append((child, iter(children)))
+				break
+			else:
+				node.size += child.size or 0
+				node.files += 1
+		else:
+			stack.pop()
+			if stack:
+				parent = stack[-1][0]
+				parent.size += node.size
+				parent.files += node.files
+				parent.dirs += node.dirs + 1
+
+def _load_cache(path):
+	"return the cache stored in path, empty if there is none or it is unreadable"
+	try:
+		with open(path, "rb") as fp:
+			return cPickle.load(fp)
+	except (IOError, EOFError, cPickle.UnpicklingError):
+		return {}
+
+def _save_cache(path, cache):
+	with open(path + ".tmp", "wb") as fp:
+		cPickle.dump(cache, fp, cPickle.HIGHEST_PROTOCOL)
+	os.rename(path + ".tmp", path) # atomic
 
 def main(args = None):
 	opts = docopt.docopt(
 		doc = __doc__,
 		argv = args)
-	root = FSNode(
-		opts["PATH"] or ".",
-		toplevel = True,
-		maxdepth = 2 if opts["-2"] else float(opts["--max-depth"])) # float because inf is the default
 	def noop(node): pass
 	if opts["--exclude"]:
-		def is_pre_prunable(node):
-			return any(fnmatch.fnmatch(node.basename, glob) for glob in opts["--exclude"].split(","))
+		def is_excluded(name):
+			return any(fnmatch.fnmatch(name, glob) for glob in opts["--exclude"].split(","))
+	else:
+		is_excluded = noop
+	sort = None if opts["--sort"] == "none" else opts["--sort"]
+	du = opts["--du"] or sort == "size"
+	def render(cache):
+		"print the tree and return the walker"
+		walker = Walker(
+			backend = opts["--backend"],
+			jobs = int(opts["--jobs"]),
+			is_excluded = is_excluded,
+			sizes = du or opts["--sizes"],
+			sort = sort,
+			reverse = opts["--reverse"],
+			cache = cache)
+		root = FSNode(
+			opts["PATH"] or ".",
+			toplevel = True,
+			maxdepth = 2 if opts["-2"] else float(opts["--max-depth"]), # float because inf is the default
+			walker = walker)
+		try:
+			if du:
+				aggregate(root)
+			for line in strfmt.iterlines(root, is_post_prunable = noop): # printed as listed
+				print line
+		finally:
+			walker.close()
+		if walker.sizes:
+			print "%i directories, %i files, %i bytes" % (walker.dirs, walker.files, walker.bytes)
+		else:
+			print "%i directories, %i files" % (walker.dirs, walker.files)
+		return walker
+	if opts["--cache"]:
+		cache = _load_cache(opts["--cache"])
 	else:
-		is_pre_prunable = noop
-	print utils.strtree(
-		root,
-		is_pre_prunable = is_pre_prunable,
-		is_post_prunable = noop)
+		cache = {} if opts["--watch"] else None
+	walker = render(cache)
+	if opts["--watch"]:
+		try:
+			while True:
+				time.sleep(float(opts["--interval"]))
+				if walker.changed():
+					sys.stdout.write("\x1b[H\x1b[2J") # clear the terminal
+					walker = render(walker.listed)
+		except KeyboardInterrupt:
+			pass
+	if opts["--cache"]:
+		_save_cache(opts["--cache"], walker.listed)